@@ -0,0 +1,59 @@
+"""
+Antimirov partial derivatives against the simp mode on string and comment
+heavy inputs.
+
+Lexes inputs of the given sizes made of many string literals, one huge
+string literal and many comment lines with the simp mode and with the
+antimirov mode, checks that both give the same tokens and prints their
+times and the size statistics recorded by the size trace (--trace-sizes):
+the size of the derivative for the simp mode and the total size of the
+sets of terms for the antimirov mode.
+
+Usage (from the repository root):
+    python2 benchmarks/antimirov_lexing.py <lexer directory> <size>...
+e.g.
+    python2 benchmarks/antimirov_lexing.py while_rpython_code 1000 10000
+"""
+import os
+import sys
+import time
+
+
+def inputs(size):
+    text = "hello world 123 (a) "
+    literal = "\"" + text + "\"\n"
+    comment = "// comment line with (words) and 42\n"
+    return [
+        ("strings", literal * (size // len(literal) + 1)),
+        ("string", "\"" + text * (size // len(text) + 1) + "\""),
+        ("comments", comment * (size // len(comment) + 1)),
+    ]
+
+
+def main(argv):
+    if len(argv) < 3:
+        print("Usage: %s <lexer directory> <size>..." % argv[0])
+        return 1
+    sys.path.insert(0, os.path.abspath(argv[1]))
+    import lexer
+    lexer.enable_size_trace()
+    for size in [int(n) for n in argv[2:]]:
+        for name, s in inputs(size):
+            tokens = {}
+            for mode in ["simp", "antimirov"]:
+                lexer.set_lexing_mode(mode)
+                lexer.SIZE_TRACE.reset()
+                start = time.time()
+                tokens[mode] = lexer.tokenise(s)
+                elapsed = time.time() - start
+                print("%s %d [%s]: %.3f seconds, %.0f chars/sec, %s" % (
+                    name, len(s), mode, elapsed, len(s) / max(elapsed, 1e-9),
+                    lexer.SIZE_TRACE.stats_string()))
+            if not lexer.same_tokens(tokens["simp"], tokens["antimirov"]):
+                print("%s %d: the tokens differ" % (name, len(s)))
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,53 @@
+"""
+Lexing time of bounded repetitions NTIMES(r, n) for large n.
+
+Lexes a record of n repetitions of a character range and of a two
+character sequence, on an input that matches it exactly, with the simp and
+the bits modes, and prints the time for each n with its ratio to the time
+for the previous n. A ratio close to the ratio of the n is linear time.
+
+Usage (from the repository root):
+    python2 benchmarks/bounded_repetition.py <lexer directory> <n>...
+e.g.
+    python2 benchmarks/bounded_repetition.py while_rpython_code 1000 2000 4000 8000
+"""
+import os
+import sys
+import time
+
+
+def main(argv):
+    if len(argv) < 3:
+        print("Usage: %s <lexer directory> <n>..." % argv[0])
+        return 1
+    sys.path.insert(0, os.path.abspath(argv[1]))
+    import lexer
+    sys.setrecursionlimit(100000)
+    bodies = [
+        ("RANGE(ab)", lexer.mk_range("ab"), "a"),
+        ("SEQ(a, b)", lexer.mk_seq(lexer.mk_char("a"), lexer.mk_char("b")), "ab"),
+    ]
+    for name, body, word in bodies:
+        for mode in ["simp", "bits"]:
+            lexer.set_lexing_mode(mode)
+            previous = None
+            for n in [int(k) for k in argv[2:]]:
+                r = lexer.mk_star(lexer.mk_recd("x", lexer.mk_ntimes(body, n)))
+                s = word * n
+                start = time.time()
+                pairs = lexer.lexing(r, s)
+                elapsed = time.time() - start
+                if len(pairs) != 1 or pairs[0][1] != s:
+                    print("NTIMES(%s, %d) [%s]: wrong tokens" % (name, n, mode))
+                    return 1
+                ratio = ""
+                if previous is not None and previous > 0:
+                    ratio = ", %.2fx the previous n" % (elapsed / previous)
+                print("NTIMES(%s, %d) [%s]: %.3f seconds%s" % (
+                    name, n, mode, elapsed, ratio))
+                previous = elapsed
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
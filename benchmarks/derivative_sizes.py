@@ -0,0 +1,41 @@
+"""
+Derivative sizes with the basic and the ACI simplifier.
+
+Lexes each source file with both simplification modes and prints the
+size() statistics of the derivative over all lexed characters, as recorded
+by the lexer's size trace (--trace-sizes).
+
+Usage (from the repository root):
+    python2 benchmarks/derivative_sizes.py <lexer directory> <source file>...
+e.g.
+    python2 benchmarks/derivative_sizes.py fun_rpython_code fun_examples/mand.fun
+"""
+import os
+import sys
+import time
+
+
+def main(argv):
+    if len(argv) < 3:
+        print("Usage: %s <lexer directory> <source file>..." % argv[0])
+        return 1
+    sys.path.insert(0, os.path.abspath(argv[1]))
+    import lexer
+    lexer.enable_size_trace()
+    for path in argv[2:]:
+        f = open(path, "r")
+        s = f.read()
+        f.close()
+        for mode in ["basic", "aci"]:
+            lexer.set_simp_mode(mode)
+            lexer.SIZE_TRACE.reset()
+            start = time.time()
+            lexer.tokenise(s)
+            elapsed = time.time() - start
+            print("%s [%s] %s (%.3f seconds)" % (
+                path, mode, lexer.SIZE_TRACE.stats_string(), elapsed))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,84 @@
+"""
+Incremental re-lexing against full lexing.
+
+Applies random edits to each source file, each replacing a few characters
+at a random offset with a piece of the same file, and re-lexes after every
+edit with LexedSource.relex. Every result is checked to be identical to a
+full tokenise of the edited text in the munch mode, which lexes the same way;
+edits that make the text unlexable must fail in both. Prints the lexemes
+re-lexed per edit and the time of both.
+
+Usage (from the repository root):
+    python2 benchmarks/incremental_relex.py <lexer directory> <edits> <source file>...
+e.g.
+    python2 benchmarks/incremental_relex.py while_rpython_code 200 examples/primes.while
+"""
+import os
+import random
+import sys
+import time
+
+
+def main(argv):
+    if len(argv) < 4:
+        print("Usage: %s <lexer directory> <edits> <source file>..." % argv[0])
+        return 1
+    sys.path.insert(0, os.path.abspath(argv[1]))
+    import lexer
+    lexer.set_lexing_mode("munch")
+    edits = int(argv[2])
+    rnd = random.Random(0)
+    for path in argv[3:]:
+        f = open(path, "r")
+        s = f.read()
+        f.close()
+        src = lexer.lex_source(s)
+        total = src.relexed
+        done = 0
+        failed = 0
+        relexed = 0
+        relex_time = 0.0
+        full_time = 0.0
+        for k in range(edits):
+            text = src.text
+            offset = rnd.randint(0, len(text))
+            removed = rnd.randint(0, min(4, len(text) - offset))
+            a = rnd.randint(0, len(text))
+            inserted = text[a:a + rnd.randint(0, 6)]
+            edited = text[:offset] + inserted + text[offset + removed:]
+
+            start = time.time()
+            try:
+                full = lexer.tokenise(edited)
+            except Exception:
+                full = None
+            full_time += time.time() - start
+
+            start = time.time()
+            try:
+                new = src.relex(offset, removed, inserted)
+            except Exception:
+                new = None
+            relex_time += time.time() - start
+
+            if full is None or new is None:
+                if full is not None or new is not None:
+                    print("%s: edit %d at %d: only one lexer failed" % (path, k, offset))
+                    return 1
+                failed += 1
+                continue
+            if not lexer.same_tokens(new.tokens, full):
+                print("%s: edit %d at %d: tokens differ from a full lex" % (path, k, offset))
+                return 1
+            done += 1
+            relexed += new.relexed
+            src = new
+        print("%s: %d edits (%d unlexable), %.1f of %d lexemes re-lexed per edit, "
+              "relex %.4fs, full lex %.4fs" % (
+                  path, done, failed, relexed / float(max(done, 1)), total,
+                  relex_time, full_time))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,292 @@
+"""
+Benchmark suite for the lexers, with results written to JSON.
+
+Lexes the programs in examples/ and fun_examples/ and synthetic inputs
+with every lexer variant: the simp mode with the basic and the ACI
+simplifier and with keyword lookup, the bits, munch, recognise and
+antimirov modes, and the DFA lexer. The synthetic inputs are long
+identifier runs, one huge string literal, many comment lines, and the
+example programs of each language repeated and cut at the last newline
+within the given sizes (1 KB to 10 MB by default).
+
+Each run is made in a fresh process, so that its peak memory is its own
+and the caches start empty, and records the characters per second and the
+peak resident memory. The maximum and mean size() of the derivatives (as
+recorded by --trace-sizes) come from a second, traced run of the same
+input, so that the trace, which keeps one entry per character, adds
+neither to the time nor to the memory of the first. The antimirov mode
+records the total size of its sets of terms; the modes in SIZE_NOTES
+record no sizes, for the reason given there. Runs that take longer than
+the timeout are killed and recorded as timed out.
+
+With --compare=<old results>, runs that got slower by more than the given
+factor (--slowdown, 1.2 by default) since the old results are listed, and
+the exit status is 1 if there are any.
+
+Usage (from the repository root):
+    python2 benchmarks/lexer_suite.py [--out=<file>] [--sizes=<n,...>]
+        [--synthetic-size=<n>] [--variants=<name,...>] [--languages=while,fun]
+        [--timeout=<seconds>] [--compare=<file>] [--slowdown=<factor>]
+e.g.
+    python2 benchmarks/lexer_suite.py --sizes=1000,10000 --out=lexers.json
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+LANGUAGES = {
+    "while": ("while_rpython_code", "examples", ".while"),
+    "fun": ("fun_rpython_code", "fun_examples", ".fun"),
+}
+
+VARIANTS = ["simp", "simp-aci", "simp-lookup", "bits", "munch", "recognise",
+            "antimirov", "dfa"]
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000, 10000000]
+
+# The variants whose runs record no derivative sizes, and why
+SIZE_NOTES = {
+    "bits": "not traced: the bits mode derives bit-coded regexes",
+    "dfa": "not traced: the DFA lexer follows a transition table",
+}
+
+
+def run_one(directory, variant, path, traced):
+    # Runs in the child process: lexes one input and prints its record,
+    # the time and memory of the run, or the derivative sizes if traced
+    sys.path.insert(0, os.path.join(ROOT, directory))
+    import lexer
+    if traced:
+        lexer.enable_size_trace()
+    if variant == "dfa":
+        import dfa_lexer
+        tokenise = dfa_lexer.tokenise
+    else:
+        if variant == "simp-aci":
+            lexer.set_simp_mode("aci")
+            variant = "simp"
+        elif variant == "simp-lookup":
+            lexer.set_keyword_mode("lookup")
+            variant = "simp"
+        lexer.set_lexing_mode(variant)
+        tokenise = lexer.tokenise
+    f = open(path, "r")
+    s = f.read()
+    f.close()
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    tokens = tokenise(s)
+    elapsed = time.time() - start
+    if traced:
+        sizes = lexer.SIZE_TRACE.sizes
+        record = {
+            "max_size": max(sizes) if sizes else None,
+            "mean_size": float(sum(sizes)) / len(sizes) if sizes else None,
+        }
+    else:
+        record = {
+            "chars": len(s),
+            "tokens": tokens.length(),
+            "seconds": elapsed,
+            "chars_per_sec": len(s) / elapsed if elapsed > 0 else None,
+            "baseline_kb": baseline,
+            "peak_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+    print(json.dumps(record))
+
+
+def measure(directory, variant, path, timeout, flag="--run"):
+    child = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), flag, directory, variant, path],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    deadline = time.time() + timeout
+    while child.poll() is None:
+        if time.time() > deadline:
+            child.kill()
+            child.wait()
+            return {"timeout": timeout}
+        time.sleep(0.05)
+    out, err = child.communicate()
+    if child.returncode != 0:
+        lines = err.strip().splitlines()
+        return {"error": lines[-1] if lines else "exit status %d" % child.returncode}
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def synthetic_inputs(size):
+    """The synthetic inputs of about size characters, by name."""
+    names = ["v" + "abcdefghij"[k % 10] * 31 + str(k) for k in range(64)]
+    identifiers = ""
+    k = 0
+    while len(identifiers) < size:
+        identifiers += names[k % len(names)] + (" " if k % 8 != 7 else "\n")
+        k += 1
+    text = "hello world 123 (a) "
+    string = "\"" + text * (size // len(text) + 1) + "\""
+    comment = "// comment line with (words) and 42\n"
+    comments = comment * (size // len(comment) + 1)
+    return [("identifiers", identifiers), ("string", string), ("comments", comments)]
+
+
+def scaled_input(programs, size):
+    """
+    The programs repeated and cut at the last newline within size
+    characters, or at the first newline if there is none.
+    """
+    text = "\n".join(programs) + "\n"
+    s = text * (size // len(text) + 1)
+    end = s.rfind("\n", 0, size)
+    if end < 0:
+        end = s.find("\n")
+    return s[:end + 1]
+
+
+def measure_sizes(directory, variant, path, timeout, record):
+    # Adds the derivative sizes of a second, traced run to record
+    note = SIZE_NOTES.get(variant)
+    if note is None:
+        sizes = measure(directory, variant, path, timeout, "--trace")
+        if "max_size" not in sizes:
+            note = "not traced: " + (sizes.get("error") or "timed out")
+            sizes = {"max_size": None, "mean_size": None}
+        elif sizes["max_size"] is None:
+            note = "not traced: the run recorded no sizes"
+        record.update(sizes)
+    else:
+        record["max_size"] = None
+        record["mean_size"] = None
+    if note is not None:
+        record["size_note"] = note
+
+
+def write_input(tmp, name, text):
+    path = os.path.join(tmp, name)
+    f = open(path, "w")
+    f.write(text)
+    f.close()
+    return path
+
+
+def compare(old_path, results, factor):
+    # Runs that are slower than factor times the old run of the same
+    # language, input and variant
+    f = open(old_path, "r")
+    old = json.load(f)
+    f.close()
+    before = {}
+    for r in old["results"]:
+        before[(r["language"], r["input"], r["variant"])] = r
+    slower = []
+    for r in results:
+        o = before.get((r["language"], r["input"], r["variant"]))
+        if o is None or not o.get("chars_per_sec") or not r.get("chars_per_sec"):
+            continue
+        if o["chars_per_sec"] > factor * r["chars_per_sec"]:
+            slower.append("%s %s [%s]: %.0f -> %.0f chars/sec" % (
+                r["language"], r["input"], r["variant"],
+                o["chars_per_sec"], r["chars_per_sec"]))
+    return slower
+
+
+def main(argv):
+    if len(argv) == 5 and argv[1] in ("--run", "--trace"):
+        run_one(argv[2], argv[3], argv[4], argv[1] == "--trace")
+        return 0
+    out = "lexer_benchmarks.json"
+    sizes = DEFAULT_SIZES
+    synthetic_size = 100000
+    variants = VARIANTS
+    languages = ["while", "fun"]
+    timeout = 300.0
+    old = None
+    factor = 1.2
+    for arg in argv[1:]:
+        name, _, value = arg.partition("=")
+        if name == "--out":
+            out = value
+        elif name == "--sizes":
+            sizes = [int(n) for n in value.split(",")]
+        elif name == "--synthetic-size":
+            synthetic_size = int(value)
+        elif name == "--variants":
+            variants = value.split(",")
+        elif name == "--languages":
+            languages = value.split(",")
+        elif name == "--timeout":
+            timeout = float(value)
+        elif name == "--compare":
+            old = value
+        elif name == "--slowdown":
+            factor = float(value)
+        else:
+            print(__doc__)
+            return 1
+
+    tmp = tempfile.mkdtemp()
+    results = []
+    for language in languages:
+        directory, examples, suffix = LANGUAGES[language]
+        inputs = []
+        programs = []
+        for name in sorted(os.listdir(os.path.join(ROOT, examples))):
+            if name.endswith(suffix):
+                path = os.path.join(ROOT, examples, name)
+                inputs.append((name, path))
+                f = open(path, "r")
+                programs.append(f.read())
+                f.close()
+        for name, text in synthetic_inputs(synthetic_size):
+            inputs.append((name, write_input(tmp, language + "-" + name, text)))
+        for size in sizes:
+            name = "scaled-%d" % size
+            inputs.append((name, write_input(tmp, language + "-" + name,
+                                             scaled_input(programs, size))))
+        for name, path in inputs:
+            for variant in variants:
+                record = measure(directory, variant, path, timeout)
+                if "chars_per_sec" in record:
+                    measure_sizes(directory, variant, path, timeout, record)
+                record["language"] = language
+                record["input"] = name
+                record["variant"] = variant
+                results.append(record)
+                if "chars_per_sec" in record:
+                    if "size_note" in record:
+                        derivatives = "derivative size " + record["size_note"]
+                    else:
+                        derivatives = "derivative size max %s mean %.1f" % (
+                            record["max_size"], record["mean_size"])
+                    print("%s %s [%s]: %d chars, %.0f chars/sec, peak %d KB, "
+                          "%s" % (language, name, variant, record["chars"],
+                                  record["chars_per_sec"] or 0,
+                                  record["peak_kb"], derivatives))
+                else:
+                    print("%s %s [%s]: %s" % (language, name, variant,
+                                              record.get("error") or "timed out"))
+        for name, path in inputs:
+            if path.startswith(tmp):
+                os.remove(path)
+    os.rmdir(tmp)
+
+    f = open(out, "w")
+    json.dump({"python": sys.version.split()[0], "time": time.time(),
+               "results": results}, f, indent=1, sort_keys=True)
+    f.close()
+    print("Results written to " + out)
+    if old is not None:
+        slower = compare(old, results, factor)
+        for line in slower:
+            print("Slower: " + line)
+        if slower:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
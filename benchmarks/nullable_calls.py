@@ -0,0 +1,139 @@
+"""
+Micro-benchmark for the nullability flags stored on regex nodes.
+
+Runs the uncached derivative pass of the lexer over a source file: der
+followed by simp for every character, and a nullable test of every
+derivative, as maximal munch makes to find the longest match. The lexer's
+der tests r.r1 of every SEQ it derives. A first pass records the regexes of
+all these tests; it wraps der to see them and is not timed. Over the same
+tests, the benchmark then counts the work of both ways of answering them:
+one flag read per test with the stored flags, and the calls the recursive
+nullable the lexer used to have makes, as it walks each regex. Both are
+timed without any counting, and so is the derivative pass itself.
+
+Usage (from the repository root):
+    python2 benchmarks/nullable_calls.py <lexer directory> <source file>
+e.g.
+    python2 benchmarks/nullable_calls.py while_rpython_code examples/primes.while
+"""
+import os
+import sys
+import time
+
+
+def load_lexer(directory):
+    sys.path.insert(0, os.path.abspath(directory))
+    import lexer
+    return lexer
+
+
+def recursive_nullable(L, r):
+    # The nullable of the lexer before the flags were stored: it walks r
+    if isinstance(r, L.ALT):
+        return recursive_nullable(L, r.r1) or recursive_nullable(L, r.r2)
+    elif isinstance(r, L.SEQ):
+        return recursive_nullable(L, r.r1) and recursive_nullable(L, r.r2)
+    elif isinstance(r, L.PLUS) or isinstance(r, L.RECD):
+        return recursive_nullable(L, r.r)
+    elif isinstance(r, L.NTIMES):
+        return r.n == 0 or recursive_nullable(L, r.r)
+    return isinstance(r, L.ONE) or isinstance(r, L.STAR) or isinstance(r, L.OPTIONAL)
+
+
+def recursive_calls(L, r):
+    # The calls recursive_nullable(L, r) makes, and its result
+    if isinstance(r, L.ALT) or isinstance(r, L.SEQ):
+        calls, value = recursive_calls(L, r.r1)
+        if value == isinstance(r, L.SEQ):
+            more, value = recursive_calls(L, r.r2)
+            calls += more
+        return calls + 1, value
+    elif isinstance(r, L.PLUS) or isinstance(r, L.RECD):
+        calls, value = recursive_calls(L, r.r)
+        return calls + 1, value
+    elif isinstance(r, L.NTIMES) and r.n > 0:
+        calls, value = recursive_calls(L, r.r)
+        return calls + 1, value
+    return 1, recursive_nullable(L, r)
+
+
+def derivative_pass(L, r, s):
+    start = time.time()
+    for c in s:
+        r = L.simp(L.der(c, r))[0]
+        L.nullable(r)
+    return time.time() - start
+
+
+def nullable_tests(L, r, s):
+    # The regexes whose nullability the derivative pass tests, in order;
+    # der calls itself through the module, so the wrapper sees every node
+    tests = []
+    der = L.der
+
+    def recording_der(c, r):
+        if isinstance(r, L.SEQ):
+            tests.append(r.r1)
+        return der(c, r)
+
+    L.der = recording_der
+    try:
+        for c in s:
+            r = L.simp(L.der(c, r))[0]
+            tests.append(r)
+    finally:
+        L.der = der
+    return tests
+
+
+def time_flags(tests):
+    start = time.time()
+    for r in tests:
+        r.is_nullable
+    return time.time() - start
+
+
+def time_recursive(L, tests):
+    start = time.time()
+    for r in tests:
+        recursive_nullable(L, r)
+    return time.time() - start
+
+
+def main(argv):
+    if len(argv) < 3:
+        print("Usage: %s <lexer directory> <source file>" % argv[0])
+        return 1
+    L = load_lexer(argv[1])
+    sys.setrecursionlimit(100000)
+    f = open(argv[2], "r")
+    s = f.read()
+    f.close()
+    r = L.FUN_REGEX if hasattr(L, "FUN_REGEX") else L.LANGUAGE_REGEX
+
+    # Warm up the intern tables so that the timed pass does not fill them
+    derivative_pass(L, r, s)
+    pass_time = derivative_pass(L, r, s)
+
+    tests = nullable_tests(L, r, s)
+    calls = 0
+    for t in tests:
+        calls += recursive_calls(L, t)[0]
+    flags_time = time_flags(tests)
+    recursive_time = time_recursive(L, tests)
+
+    n = float(max(len(s), 1))
+    print("%d characters, %.2f nullability tests/char, derivative pass "
+          "%.1f us/char" % (len(s), len(tests) / n, pass_time * 1e6 / n))
+    print("recursive nullable: %.2f calls/char, %.2f us/char" %
+          (calls / n, recursive_time * 1e6 / n))
+    print("stored flags:       %.2f reads/char, %.2f us/char" %
+          (len(tests) / n, flags_time * 1e6 / n))
+    print("%.1fx fewer nullability steps, %.1fx faster" % (
+        calls / float(max(len(tests), 1)),
+        recursive_time / max(flags_time, 1e-9)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,89 @@
+"""
+Parallel lexing of a large WHILE source against tokenise.
+
+Builds a large source by repeating the given WHILE files until it has at
+least the given number of characters, lexes it once with tokenise and then
+with tokenise_parallel for 1, 2, 4, ... up to the given number of workers.
+Every parallel result is checked to be identical to the sequential one,
+including the symbol ids, and so are the results for a few small sources
+whose cuts are easy to get wrong. Prints the time and the speedup for each worker
+count.
+
+Usage (from the repository root):
+    python2 benchmarks/parallel_lexing.py <max workers> <characters> <source file>...
+e.g.
+    python2 benchmarks/parallel_lexing.py 8 200000 examples/primes.while examples/collatz2.while
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "while_python2_code"))
+
+
+# Sources where a // does not start a comment, so the newline after it may
+# be inside a string
+TRICKY_SOURCES = [
+    "x := 1;\n" * 50 + "x := 4 // \"a\nb\";\n" + "y := 2;\n" * 50,
+    "x := 1;\n" * 50 + "// a comment (1) here\n" + "y := 2;\n" * 50,
+]
+
+
+def same_result(lexer, tokens, expected):
+    return (lexer.same_tokens(tokens, expected) and
+            tokens.symbols.names == expected.symbols.names)
+
+
+def main(argv):
+    if len(argv) < 4:
+        print("Usage: %s <max workers> <characters> <source file>..." % argv[0])
+        return 1
+    import lexer
+    from parallel_lexer import tokenise_parallel
+    from multiprocessing import Pool
+    max_workers = int(argv[1])
+    size = int(argv[2])
+    parts = []
+    for path in argv[3:]:
+        f = open(path, "r")
+        parts.append(f.read())
+        f.close()
+    s = ""
+    while len(s) < size:
+        s += "\n".join(parts) + "\n"
+
+    # Warm up the derivative cache, which the workers inherit
+    lexer.tokenise(s)
+    start = time.time()
+    expected = lexer.tokenise(s)
+    sequential = time.time() - start
+    print("%d characters, %d tokens, tokenise %.3fs" % (
+        len(s), expected.length(), sequential))
+
+    workers = 1
+    while workers <= max_workers:
+        pool = Pool(workers)
+        start = time.time()
+        tokens = tokenise_parallel(s, workers, pool)
+        elapsed = time.time() - start
+        if not same_result(lexer, tokens, expected):
+            print("%d workers: tokens differ from tokenise" % workers)
+            return 1
+        for k in range(len(TRICKY_SOURCES)):
+            t = TRICKY_SOURCES[k]
+            if not same_result(lexer, tokenise_parallel(t, workers, pool),
+                               lexer.tokenise(t)):
+                print("%d workers: tokens of tricky source %d differ from "
+                      "tokenise" % (workers, k))
+                return 1
+        pool.close()
+        pool.join()
+        print("%d workers: %.3fs, speedup %.2f" % (
+            workers, elapsed, sequential / elapsed))
+        workers *= 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
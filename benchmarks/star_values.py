@@ -0,0 +1,53 @@
+"""
+Lexing time of inputs that build long Stars and Pls values.
+
+Lexes one identifier of n characters, one run of n spaces and n/2 short
+tokens under the top-level star with the simp and the munch modes, and
+prints the time for each n with its ratio to the time for the previous n.
+A ratio close to the ratio of the n is linear time.
+
+Usage (from the repository root):
+    python2 benchmarks/star_values.py <lexer directory> <n>...
+e.g.
+    python2 benchmarks/star_values.py while_rpython_code 10000 20000 40000
+"""
+import os
+import sys
+import time
+
+
+def inputs(n):
+    return [
+        ("identifier", "x" * n),
+        ("spaces", "x" + " " * n),
+        ("tokens", "x " * (n // 2)),
+    ]
+
+
+def main(argv):
+    if len(argv) < 3:
+        print("Usage: %s <lexer directory> <n>..." % argv[0])
+        return 1
+    sys.path.insert(0, os.path.abspath(argv[1]))
+    import lexer
+    sizes = [int(k) for k in argv[2:]]
+    for name, _ in inputs(0):
+        for mode in ["simp", "munch"]:
+            lexer.set_lexing_mode(mode)
+            previous = None
+            for n in sizes:
+                s = dict(inputs(n))[name]
+                start = time.time()
+                tokens = lexer.tokenise(s)
+                elapsed = time.time() - start
+                ratio = ""
+                if previous is not None and previous > 0:
+                    ratio = ", %.2fx the previous n" % (elapsed / previous)
+                print("%s %d [%s]: %d tokens, %.3f seconds%s" % (
+                    name, n, mode, tokens.length(), elapsed, ratio))
+                previous = elapsed
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
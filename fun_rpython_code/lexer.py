@@ -1,5 +1,7 @@
 class Rexp:
-    __slots__ = ()  # No instance attributes in base class
+    # Every node records whether it is nullable and its size when it is
+    # constructed, so neither has to be recomputed by walking the regex
+    __slots__ = ('is_nullable', 'node_size')
 
     def __str__(self):
         return self.__repr__()
@@ -11,14 +13,24 @@ class Rexp:
 class ZERO(Rexp):
     __slots__ = ()
 
+    def __init__(self):
+        self.is_nullable = False
+        self.node_size = 1
+
 class ONE(Rexp):
     __slots__ = ()
 
+    def __init__(self):
+        self.is_nullable = True
+        self.node_size = 1
+
 class CHAR(Rexp):
     __slots__ = ('c',)
 
     def __init__(self, c):
         self.c = c
+        self.is_nullable = False
+        self.node_size = 1
 
     def __repr__(self):
         return "CHAR(\"%s\")" % self.c
@@ -29,6 +41,8 @@ class ALT(Rexp):
     def __init__(self, r1, r2):
         self.r1 = r1
         self.r2 = r2
+        self.is_nullable = r1.is_nullable or r2.is_nullable
+        self.node_size = 1 + r1.node_size + r2.node_size
 
     def __repr__(self):
         return "ALT(%s, %s)" % (self.r1, self.r2)
@@ -39,6 +53,8 @@ class SEQ(Rexp):
     def __init__(self, r1, r2):
         self.r1 = r1
         self.r2 = r2
+        self.is_nullable = r1.is_nullable and r2.is_nullable
+        self.node_size = 1 + r1.node_size + r2.node_size
 
     def __repr__(self):
         return "SEQ(%s, %s)" % (self.r1, self.r2)
@@ -48,15 +64,26 @@ class STAR(Rexp):
 
     def __init__(self, r):
         self.r = r
+        self.is_nullable = True
+        self.node_size = 1 + r.node_size
 
     def __repr__(self):
         return "STAR(%s)" % self.r
 
 class RANGE(Rexp):
-    __slots__ = ('cs',)
+    __slots__ = ('cs', 'member')
 
     def __init__(self, cs):
         self.cs = list(cs)
+        self.is_nullable = False
+        self.node_size = 1
+        # membership of all 256 characters, for constant-time tests
+        self.member = [False] * 256
+        for c in self.cs:
+            self.member[ord(c)] = True
+
+    def contains(self, c):
+        return self.member[ord(c)]
 
     def __repr__(self):
         return "RANGE(%s)" % self.cs
@@ -66,6 +93,8 @@ class PLUS(Rexp):
 
     def __init__(self, r):
         self.r = r
+        self.is_nullable = r.is_nullable
+        self.node_size = 1 + r.node_size
 
     def __repr__(self):
         return "PLUS(%s)" % self.r
@@ -75,6 +104,8 @@ class OPTIONAL(Rexp):
 
     def __init__(self, r):
         self.r = r
+        self.is_nullable = True
+        self.node_size = 1 + r.node_size
 
     def __repr__(self):
         return "OPTIONAL(%s)" % self.r
@@ -85,6 +116,8 @@ class NTIMES(Rexp):
     def __init__(self, r, n):
         self.r = r
         self.n = n
+        self.is_nullable = n == 0 or r.is_nullable
+        self.node_size = 1 + r.node_size
 
     def __repr__(self):
         return "NTIMES(%s, %d)" % (self.r, self.n)
@@ -95,10 +128,320 @@ class RECD(Rexp):
     def __init__(self, x, r):
         self.x = x
         self.r = r
+        self.is_nullable = r.is_nullable
+        self.node_size = 1 + r.node_size
 
     def __repr__(self):
         return "RECD(\"%s\", %s)" % (self.x, self.r)
 
+# Hash-consing of regular expressions: structurally equal regexes built
+# through the mk_* constructors are the same object, so they can be compared
+# with "is" and used directly as dictionary keys.
+
+class InternTable(object):
+    __slots__ = ('zero', 'one', 'chars', 'alts', 'seqs', 'stars', 'ranges',
+                 'pluses', 'optionals', 'ntimes', 'recds', 'roots')
+
+    def __init__(self):
+        self.zero = ZERO()
+        self.one = ONE()
+        self.roots = []
+        self.clear([])
+
+    def clear(self, live):
+        # Forgets every node except ZERO, ONE and the nodes of the kept
+        # roots and of the regexes in live, which keep their identity
+        self.chars = {}
+        self.alts = {}
+        self.seqs = {}
+        self.stars = {}
+        self.ranges = {}
+        self.pluses = {}
+        self.optionals = {}
+        self.ntimes = {}
+        self.recds = {}
+        for r in self.roots:
+            self.register(r)
+        for r in live:
+            self.register(r)
+
+    def register(self, r):
+        # Enters r and its subexpressions, built before the last clear
+        stack = [r]
+        while len(stack) > 0:
+            r = stack.pop()
+            if isinstance(r, CHAR):
+                self.chars[r.c] = r
+            elif isinstance(r, ALT):
+                if (r.r1, r.r2) not in self.alts:
+                    self.alts[(r.r1, r.r2)] = r
+                    stack.append(r.r1)
+                    stack.append(r.r2)
+            elif isinstance(r, SEQ):
+                if (r.r1, r.r2) not in self.seqs:
+                    self.seqs[(r.r1, r.r2)] = r
+                    stack.append(r.r1)
+                    stack.append(r.r2)
+            elif isinstance(r, STAR):
+                if r.r not in self.stars:
+                    self.stars[r.r] = r
+                    stack.append(r.r)
+            elif isinstance(r, RANGE):
+                self.ranges["".join(r.cs)] = r
+            elif isinstance(r, PLUS):
+                if r.r not in self.pluses:
+                    self.pluses[r.r] = r
+                    stack.append(r.r)
+            elif isinstance(r, OPTIONAL):
+                if r.r not in self.optionals:
+                    self.optionals[r.r] = r
+                    stack.append(r.r)
+            elif isinstance(r, NTIMES):
+                if (r.r, r.n) not in self.ntimes:
+                    self.ntimes[(r.r, r.n)] = r
+                    stack.append(r.r)
+            elif isinstance(r, RECD):
+                if (r.x, r.r) not in self.recds:
+                    self.recds[(r.x, r.r)] = r
+                    stack.append(r.r)
+
+    def size(self):
+        return (2 + len(self.chars) + len(self.alts) + len(self.seqs) +
+                len(self.stars) + len(self.ranges) + len(self.pluses) +
+                len(self.optionals) + len(self.ntimes) + len(self.recds))
+
+INTERN = InternTable()
+
+# The intern table is cleared together with the derivative cache, or when it
+# holds more nodes than this
+INTERN_SIZE = 100000
+
+def keep_interned(r):
+    # Keeps r, a regex the lexers start from, in the intern table when it
+    # is cleared
+    INTERN.roots.append(r)
+    INTERN.register(r)
+
+def mk_zero():
+    return INTERN.zero
+
+def mk_one():
+    return INTERN.one
+
+def mk_char(c):
+    r = INTERN.chars.get(c, None)
+    if r is None:
+        r = CHAR(c)
+        INTERN.chars[c] = r
+    return r
+
+def mk_alt(r1, r2):
+    key = (r1, r2)
+    r = INTERN.alts.get(key, None)
+    if r is None:
+        r = ALT(r1, r2)
+        INTERN.alts[key] = r
+    return r
+
+def mk_seq(r1, r2):
+    key = (r1, r2)
+    r = INTERN.seqs.get(key, None)
+    if r is None:
+        r = SEQ(r1, r2)
+        INTERN.seqs[key] = r
+    return r
+
+def mk_star(r1):
+    r = INTERN.stars.get(r1, None)
+    if r is None:
+        r = STAR(r1)
+        INTERN.stars[r1] = r
+    return r
+
+def mk_range(cs):
+    key = "".join(cs)
+    r = INTERN.ranges.get(key, None)
+    if r is None:
+        r = RANGE(key)
+        INTERN.ranges[key] = r
+    return r
+
+def mk_plus(r1):
+    r = INTERN.pluses.get(r1, None)
+    if r is None:
+        r = PLUS(r1)
+        INTERN.pluses[r1] = r
+    return r
+
+def mk_optional(r1):
+    r = INTERN.optionals.get(r1, None)
+    if r is None:
+        r = OPTIONAL(r1)
+        INTERN.optionals[r1] = r
+    return r
+
+def mk_ntimes(r1, n):
+    key = (r1, n)
+    r = INTERN.ntimes.get(key, None)
+    if r is None:
+        r = NTIMES(r1, n)
+        INTERN.ntimes[key] = r
+    return r
+
+def mk_recd(x, r1):
+    key = (x, r1)
+    r = INTERN.recds.get(key, None)
+    if r is None:
+        r = RECD(x, r1)
+        INTERN.recds[key] = r
+    return r
+
+def intern_rexp(r):
+    # Rebuild a regular expression bottom-up out of interned nodes
+    if isinstance(r, ZERO):
+        return mk_zero()
+    elif isinstance(r, ONE):
+        return mk_one()
+    elif isinstance(r, CHAR):
+        return mk_char(r.c)
+    elif isinstance(r, ALT):
+        return mk_alt(intern_rexp(r.r1), intern_rexp(r.r2))
+    elif isinstance(r, SEQ):
+        return mk_seq(intern_rexp(r.r1), intern_rexp(r.r2))
+    elif isinstance(r, STAR):
+        return mk_star(intern_rexp(r.r))
+    elif isinstance(r, RANGE):
+        return mk_range(r.cs)
+    elif isinstance(r, PLUS):
+        return mk_plus(intern_rexp(r.r))
+    elif isinstance(r, OPTIONAL):
+        return mk_optional(intern_rexp(r.r))
+    elif isinstance(r, NTIMES):
+        return mk_ntimes(intern_rexp(r.r), r.n)
+    elif isinstance(r, RECD):
+        return mk_recd(r.x, intern_rexp(r.r))
+    else:
+        raise Exception("Unknown regular expression type")
+
+# Alphabet partition: characters that none of the CHARs and RANGEs of a
+# regex can tell apart have the same derivatives, so derivatives only need
+# to be computed once per class of such characters, by its representative.
+
+class CharClasses(object):
+    __slots__ = ('table', 'reps')
+
+    def __init__(self, table, reps):
+        self.table = table  # ord(c) -> class number, for all 256 characters
+        self.reps = reps    # class number -> representative character
+
+    def count(self):
+        return len(self.reps)
+
+    def class_of(self, c):
+        return self.table[ord(c)]
+
+    def representative(self, c):
+        return self.reps[self.table[ord(c)]]
+
+def collect_charsets(r, sets, seen):
+    if r in seen:
+        return
+    seen[r] = True
+    if isinstance(r, CHAR) or isinstance(r, RANGE):
+        sets.append(r)
+    elif isinstance(r, ALT) or isinstance(r, SEQ):
+        collect_charsets(r.r1, sets, seen)
+        collect_charsets(r.r2, sets, seen)
+    elif (isinstance(r, STAR) or isinstance(r, PLUS) or isinstance(r, OPTIONAL) or
+          isinstance(r, NTIMES) or isinstance(r, RECD)):
+        collect_charsets(r.r, sets, seen)
+
+def alphabet_partition(r):
+    sets = []
+    collect_charsets(r, sets, {})
+    table = [0] * 256
+    reps = []
+    index = {}
+    for i in range(256):
+        c = chr(i)
+        # characters with the same membership in every set share a class
+        sig = []
+        for cs in sets:
+            if isinstance(cs, CHAR):
+                member = cs.c == c
+            else:
+                assert isinstance(cs, RANGE)
+                member = cs.contains(c)
+            if member:
+                sig.append("1")
+            else:
+                sig.append("0")
+        key = "".join(sig)
+        k = index.get(key, -1)
+        if k < 0:
+            k = len(reps)
+            index[key] = k
+            reps.append(c)
+        table[i] = k
+    return CharClasses(table, reps)
+
+class PartitionTable(object):
+    __slots__ = ('partitions',)
+
+    def __init__(self):
+        self.partitions = {}
+
+PARTITIONS = PartitionTable()
+
+def partition_for(r):
+    # The partition of each regex lexed with is computed once and kept
+    classes = PARTITIONS.partitions.get(r, None)
+    if classes is None:
+        classes = alphabet_partition(r)
+        PARTITIONS.partitions[r] = classes
+    return classes
+
+class FirstChars(object):
+    __slots__ = ('firsts',)
+
+    def __init__(self):
+        self.firsts = {}
+
+    def get(self, r):
+        # The characters that can start a match of r, as the keys of a dict
+        chars = self.firsts.get(r, None)
+        if chars is None:
+            chars = {}
+            self.collect(r, chars)
+            self.firsts[r] = chars
+        return chars
+
+    def collect(self, r, chars):
+        if isinstance(r, CHAR):
+            chars[r.c] = True
+        elif isinstance(r, RANGE):
+            for c in r.cs:
+                chars[c] = True
+        elif isinstance(r, ALT):
+            self.collect(r.r1, chars)
+            self.collect(r.r2, chars)
+        elif isinstance(r, SEQ):
+            self.collect(r.r1, chars)
+            if r.r1.is_nullable:
+                self.collect(r.r2, chars)
+        elif isinstance(r, STAR) or isinstance(r, PLUS) or isinstance(r, OPTIONAL):
+            self.collect(r.r, chars)
+        elif isinstance(r, NTIMES):
+            if r.n > 0:
+                self.collect(r.r, chars)
+        elif isinstance(r, RECD):
+            self.collect(r.r, chars)
+
+# The first characters of the erasures that bder meets, so that it skips the
+# alternatives that cannot match the next character; cleared with the intern
+# table, whose nodes are its keys
+FIRST_CHARS = FirstChars()
+
 # Values for evaluation results
 class Val:
     __slots__ = ()
@@ -150,13 +493,32 @@ class Right(Val):
         return "Right(%s)" % self.v
 
 class Stars(Val):
-    __slots__ = ('vs',)
+    # The iterations of a star as a list of cells, like Ntms: the value of
+    # the first iteration and the cell of the iterations after it, so inj
+    # adds an iteration in front without copying the others. The empty
+    # cell has no rest and n == 0.
+    __slots__ = ('v', 'rest', 'n')
+
+    def __init__(self, v, rest):
+        self.v = v
+        self.rest = rest
+        if rest is None:
+            self.n = 0
+        else:
+            self.n = rest.n + 1
 
-    def __init__(self, vs):
-        self.vs = vs
+    def values(self):
+        vs = []
+        cell = self
+        while cell.rest is not None:
+            vs.append(cell.v)
+            cell = cell.rest
+        return vs
 
     def __repr__(self):
-        return "Stars(%s)" % self.vs
+        return "Stars(%s)" % self.values()
+
+STARS_EMPTY = Stars(None, None)
 
 class Rng(Val):
     __slots__ = ('cs',)
@@ -168,13 +530,19 @@ class Rng(Val):
         return "Rng(\"%s\")" % self.cs
 
 class Pls(Val):
-    __slots__ = ('vs',)
+    # The first iteration of a plus and the Stars cell of the others
+    __slots__ = ('v', 'rest', 'n')
 
-    def __init__(self, vs):
-        self.vs = vs
+    def __init__(self, v, rest):
+        self.v = v
+        self.rest = rest
+        self.n = rest.n + 1
+
+    def values(self):
+        return [self.v] + self.rest.values()
 
     def __repr__(self):
-        return "Pls(%s)" % self.vs
+        return "Pls(%s)" % self.values()
 
 class Opt(Val):
     __slots__ = ('v',)
@@ -186,13 +554,32 @@ class Opt(Val):
         return "Opt(%s)" % self.v
 
 class Ntms(Val):
-    __slots__ = ('vs',)
+    # The iterations of a bounded repetition as a list of cells: the value of
+    # the first iteration and the cell of the iterations after it, which inj
+    # shares rather than copies, with their number n. The empty cell has no
+    # rest and n == 0.
+    __slots__ = ('v', 'rest', 'n')
+
+    def __init__(self, v, rest):
+        self.v = v
+        self.rest = rest
+        if rest is None:
+            self.n = 0
+        else:
+            self.n = rest.n + 1
 
-    def __init__(self, vs):
-        self.vs = vs
+    def values(self):
+        vs = []
+        cell = self
+        while cell.rest is not None:
+            vs.append(cell.v)
+            cell = cell.rest
+        return vs
 
     def __repr__(self):
-        return "Ntms(%s)" % self.vs
+        return "Ntms(%s)" % self.values()
+
+NTMS_EMPTY = Ntms(None, None)
 
 class Rec(Val):
     __slots__ = ('x', 'v')
@@ -204,103 +591,46 @@ class Rec(Val):
     def __repr__(self):
         return "Rec(\"%s\", %s)" % (self.x, self.v)
 
-def eq_rexp(r1, r2):
-    """Structural equality of regular expressions"""
-    if isinstance(r1, ZERO) and isinstance(r2, ZERO):
-        return True
-    if isinstance(r1, ONE) and isinstance(r2, ONE):
-        return True
-    if isinstance(r1, CHAR) and isinstance(r2, CHAR):
-        return r1.c == r2.c
-    if isinstance(r1, ALT) and isinstance(r2, ALT):
-        return eq_rexp(r1.r1, r2.r1) and eq_rexp(r1.r2, r2.r2)
-    if isinstance(r1, SEQ) and isinstance(r2, SEQ):
-        return eq_rexp(r1.r1, r2.r1) and eq_rexp(r1.r2, r2.r2)
-    if isinstance(r1, STAR) and isinstance(r2, STAR):
-        return eq_rexp(r1.r, r2.r)
-    if isinstance(r1, RANGE) and isinstance(r2, RANGE):
-        if len(r1.cs) != len(r2.cs):
-            return False
-        for i in range(len(r1.cs)):
-            if r1.cs[i] != r2.cs[i]:
-                return False
-        return True
-    if isinstance(r1, PLUS) and isinstance(r2, PLUS):
-        return eq_rexp(r1.r, r2.r)
-    if isinstance(r1, OPTIONAL) and isinstance(r2, OPTIONAL):
-        return eq_rexp(r1.r, r2.r)
-    if isinstance(r1, NTIMES) and isinstance(r2, NTIMES):
-        return (r1.n == r2.n) and eq_rexp(r1.r, r2.r)
-    if isinstance(r1, RECD) and isinstance(r2, RECD):
-        if r1.x != r2.x:
-            return False
-        return eq_rexp(r1.r, r2.r)
-    return False
-
 # Checks if a regular expression matches the empty string
 def nullable(r):
-    if isinstance(r, ZERO):
-        return False
-    elif isinstance(r, ONE):
-        return True
-    elif isinstance(r, CHAR):
-        return False
-    elif isinstance(r, ALT):
-        return nullable(r.r1) or nullable(r.r2)
-    elif isinstance(r, SEQ):
-        return nullable(r.r1) and nullable(r.r2)
-    elif isinstance(r, STAR):
-        return True
-    elif isinstance(r, RANGE):
-        return False
-    elif isinstance(r, PLUS):
-        return nullable(r.r)
-    elif isinstance(r, OPTIONAL):
-        return True
-    elif isinstance(r, NTIMES):
-        if r.n == 0:
-            return True
-        else:
-            return nullable(r.r)
-    elif isinstance(r, RECD):
-        return nullable(r.r)
-    else:
-        raise Exception("Unknown regular expression type")
+    return r.is_nullable
 
 # Derivative of a regular expression with respect to a character
 def der(c, r):
+    if COUNTERS_BUILT and COUNTERS.enabled:
+        COUNTERS.count(C_DER, 0)
     if isinstance(r, ZERO):
-        return ZERO()
+        return mk_zero()
     elif isinstance(r, ONE):
-        return ZERO()
+        return mk_zero()
     elif isinstance(r, CHAR):
         if r.c == c:
-            return ONE()
+            return mk_one()
         else:
-            return ZERO()
+            return mk_zero()
     elif isinstance(r, ALT):
-        return ALT(der(c, r.r1), der(c, r.r2))
+        return mk_alt(der(c, r.r1), der(c, r.r2))
     elif isinstance(r, SEQ):
-        if nullable(r.r1):
-            return ALT(SEQ(der(c, r.r1), r.r2), der(c, r.r2))
+        if r.r1.is_nullable:
+            return mk_alt(mk_seq(der(c, r.r1), r.r2), der(c, r.r2))
         else:
-            return SEQ(der(c, r.r1), r.r2)
+            return mk_seq(der(c, r.r1), r.r2)
     elif isinstance(r, STAR):
-        return SEQ(der(c, r.r), STAR(r.r))
+        return mk_seq(der(c, r.r), r)
     elif isinstance(r, RANGE):
-        if c in r.cs:
-            return ONE()
+        if r.contains(c):
+            return mk_one()
         else:
-            return ZERO()
+            return mk_zero()
     elif isinstance(r, PLUS):
-        return SEQ(der(c, r.r), STAR(r.r))
+        return mk_seq(der(c, r.r), mk_star(r.r))
     elif isinstance(r, OPTIONAL):
         return der(c, r.r)
     elif isinstance(r, NTIMES):
         if r.n == 0:
-            return ZERO()
+            return mk_zero()
         else:
-            return SEQ(der(c, r.r), NTIMES(r.r, r.n - 1))
+            return mk_seq(der(c, r.r), mk_ntimes(r.r, r.n - 1))
     elif isinstance(r, RECD):
         return der(c, r.r)
     else:
@@ -334,133 +664,140 @@ def regex_to_string(r):
 
 # Derivative of a regular expression with respect to a string
 def ders(r, s):
-    if not s:
-        return r
-    else:
-        return ders(der(s[0], r), s[1:])
+    for c in s:
+        r = der(c, r)
+    return r
 
 def size(r):
     """Compute the size of a regular expression"""
-    if isinstance(r, ZERO) or isinstance(r, ONE):
-        return 1
-    elif isinstance(r, CHAR):
-        return 1
-    elif isinstance(r, ALT):
-        return 1 + size(r.r1) + size(r.r2)
-    elif isinstance(r, SEQ):
-        return 1 + size(r.r1) + size(r.r2)
-    elif isinstance(r, STAR):
-        return 1 + size(r.r)
-    elif isinstance(r, RANGE):
-        return 1
-    elif isinstance(r, PLUS):
-        return 1 + size(r.r)
-    elif isinstance(r, OPTIONAL):
-        return 1 + size(r.r)
-    elif isinstance(r, NTIMES):
-        return 1 + size(r.r)
-    elif isinstance(r, RECD):
-        return 1 + size(r.r)
-    else:
-        raise Exception("Unknown regular expression type")
+    return r.node_size
 
-# Flatten function to convert a value to a string
+# Flatten function to convert a value to a string. The value is walked with
+# an explicit stack, appending its characters to one buffer, so long Stars
+# and deep Sequ chains are neither copied at every level nor recursed into.
 def flatten(v):
-    if isinstance(v, Empty):
-        return ""
-    elif isinstance(v, Chr):
-        return v.c
-    elif isinstance(v, Left):
-        return flatten(v.v)
-    elif isinstance(v, Right):
-        return flatten(v.v)
-    elif isinstance(v, Sequ):
-        return flatten(v.v1) + flatten(v.v2)
-    elif isinstance(v, Stars):
-        result = ""
-        for val in v.vs:
-            result += flatten(val)
-        return result
-    elif isinstance(v, Rng):
-        result = ""
-        for c in v.cs:
-            if isinstance(c, Chr):
-                result += c.c
-        return result
-    elif isinstance(v, Pls):
-        result = ""
-        for val in v.vs:
-            result += flatten(val)
-        return result
-    elif isinstance(v, Opt):
-        return flatten(v.v)
-    elif isinstance(v, Ntms):
-        result = ""
-        for val in v.vs:
-            result += flatten(val)
-        return result
-    elif isinstance(v, Rec):
-        return flatten(v.v)
-    else:
-        raise Exception("Unknown value type")
+    chars = []
+    flatten_into(v, chars)
+    if COUNTERS_BUILT and COUNTERS.enabled:
+        COUNTERS.nodes[C_FLATTEN] += 1
+    return "".join(chars)
+
+def flatten_into(v, chars):
+    # One call per value flattened; the caller counts the string it joins
+    if COUNTERS_BUILT and COUNTERS.enabled:
+        COUNTERS.count(C_FLATTEN, 0)
+    stack = [v]
+    while len(stack) > 0:
+        v = stack.pop()
+        if isinstance(v, Chr):
+            chars.append(v.c)
+        elif isinstance(v, Sequ):
+            stack.append(v.v2)
+            stack.append(v.v1)
+        elif isinstance(v, Stars):
+            # the first iteration is taken first, then the cell of the rest
+            if v.rest is not None:
+                stack.append(v.rest)
+                stack.append(v.v)
+        elif isinstance(v, Left):
+            stack.append(v.v)
+        elif isinstance(v, Right):
+            stack.append(v.v)
+        elif isinstance(v, Empty):
+            pass
+        elif isinstance(v, Pls):
+            stack.append(v.rest)
+            stack.append(v.v)
+        elif isinstance(v, Ntms):
+            if v.rest is not None:
+                stack.append(v.rest)
+                stack.append(v.v)
+        elif isinstance(v, Rng):
+            for c in v.cs:
+                if isinstance(c, Chr):
+                    chars.append(c.c)
+        elif isinstance(v, Opt):
+            stack.append(v.v)
+        elif isinstance(v, Rec):
+            stack.append(v.v)
+        else:
+            raise Exception("Unknown value type")
 
-# Environment function to extract the values from a value
+# Environment function to extract the values from a value, walked like
+# flatten; the (label, text) pairs are appended to one output list
 def env(v):
-    if isinstance(v, Empty):
-        return []
-    elif isinstance(v, Chr):
-        return []
-    elif isinstance(v, Left):
-        return env(v.v)
-    elif isinstance(v, Right):
-        return env(v.v)
-    elif isinstance(v, Sequ):
-        return env(v.v1) + env(v.v2)
-    elif isinstance(v, Stars):
-        result = []
-        for val in v.vs:
-            result += env(val)
-        return result
-    elif isinstance(v, Rng):
-        return []
-    elif isinstance(v, Pls):
-        result = []
-        for val in v.vs:
-            result += env(val)
-        return result
-    elif isinstance(v, Opt):
-        return env(v.v)
-    elif isinstance(v, Ntms):
-        result = []
-        for val in v.vs:
-            result += env(val)
-        return result
-    elif isinstance(v, Rec):
-        return [(v.x, flatten(v.v))] + env(v.v)
-    else:
-        raise Exception("Unknown value type")
+    out = []
+    env_into(v, out)
+    return out
+
+def env_into(v, out):
+    counting = COUNTERS_BUILT and COUNTERS.enabled
+    if counting:
+        COUNTERS.count(C_ENV, 0)
+    stack = [v]
+    chars = []
+    while len(stack) > 0:
+        v = stack.pop()
+        if isinstance(v, Chr):
+            pass
+        elif isinstance(v, Sequ):
+            stack.append(v.v2)
+            stack.append(v.v1)
+        elif isinstance(v, Stars):
+            # the first iteration is taken first, then the cell of the rest
+            if v.rest is not None:
+                stack.append(v.rest)
+                stack.append(v.v)
+        elif isinstance(v, Left):
+            stack.append(v.v)
+        elif isinstance(v, Right):
+            stack.append(v.v)
+        elif isinstance(v, Rec):
+            # the record comes before the records inside it
+            flatten_into(v.v, chars)
+            out.append((v.x, "".join(chars)))
+            del chars[:]
+            if counting:
+                COUNTERS.nodes[C_ENV] += 1
+                COUNTERS.nodes[C_FLATTEN] += 1
+            stack.append(v.v)
+        elif isinstance(v, Empty) or isinstance(v, Rng):
+            pass
+        elif isinstance(v, Pls):
+            stack.append(v.rest)
+            stack.append(v.v)
+        elif isinstance(v, Ntms):
+            if v.rest is not None:
+                stack.append(v.rest)
+                stack.append(v.v)
+        elif isinstance(v, Opt):
+            stack.append(v.v)
+        else:
+            raise Exception("Unknown value type")
 
 # Make epsilon function to compute HOW a regular expression matches the empty string
 def mkeps(r):
+    if COUNTERS_BUILT and COUNTERS.enabled:
+        COUNTERS.count(C_MKEPS, 1)
     if isinstance(r, ONE):
         return Empty()
     elif isinstance(r, ALT):
-        if nullable(r.r1):
+        if r.r1.is_nullable:
             return Left(mkeps(r.r1))
         else:
             return Right(mkeps(r.r2))
     elif isinstance(r, SEQ):
         return Sequ(mkeps(r.r1), mkeps(r.r2))
     elif isinstance(r, STAR):
-        return Stars([])
+        return STARS_EMPTY
     elif isinstance(r, PLUS):
-        return Pls([mkeps(r.r)])
+        return Pls(mkeps(r.r), STARS_EMPTY)
     elif isinstance(r, OPTIONAL):
         return Opt(Empty())
     elif isinstance(r, NTIMES):
         if r.n == 0:
-            return Ntms([])
-        return Ntms([mkeps(r.r)])
+            return NTMS_EMPTY
+        return Ntms(mkeps(r.r), NTMS_EMPTY)
     elif isinstance(r, RECD):
         return Rec(r.x, mkeps(r.r))
     else:
@@ -468,12 +805,14 @@ def mkeps(r):
 
 # Injection function to compute HOW a regular expression matches a string
 def inj(r, c, v):
+    if COUNTERS_BUILT and COUNTERS.enabled:
+        COUNTERS.count(C_INJ, 1)
     if isinstance(r, STAR):
         sequ = v
         assert isinstance(sequ, Sequ)
         star = sequ.v2
         assert isinstance(star, Stars)
-        return Stars([inj(r.r, c, sequ.v1)] + star.vs)
+        return Stars(inj(r.r, c, sequ.v1), star)
     elif isinstance(r, SEQ):
         if isinstance(v, Sequ):
             return Sequ(inj(r.r1, c, v.v1), v.v2)
@@ -496,19 +835,31 @@ def inj(r, c, v):
         if isinstance(v, Sequ):
             star = v.v2
             assert isinstance(star, Stars)
-            return Pls([inj(r.r, c, v.v1)] + star.vs)
+            return Pls(inj(r.r, c, v.v1), star)
     elif isinstance(r, OPTIONAL):
         return Opt(inj(r.r, c, v))
     elif isinstance(r, NTIMES):
         if isinstance(v, Sequ):
-            assert isinstance(v.v2, Ntms)
-            return Ntms([inj(r.r, c, v.v1)] + v.v2.vs)
+            rest = v.v2
+            assert isinstance(rest, Ntms)
+            return Ntms(inj(r.r, c, v.v1), rest)
     elif isinstance(r, RECD):
         return Rec(r.x, inj(r.r, c, v))
     else:
         raise Exception("Unknown regular expression type")
 
-# Rectification tags
+# Rectification functions are encoded as integer code. A node is its tag
+# followed by the indices of its children in the same code:
+#   TAG_ID, TAG_ERROR                      [tag]
+#   TAG_RIGHT, TAG_LEFT, TAG_RECD          [tag, f]
+#   TAG_ALT, TAG_SEQ, TAG_SEQ_EMPTY1/2     [tag, f1, f2]
+#   TAG_ALTS                               [tag, n, e1, ..., en]
+# where each ei of TAG_ALTS is the index of an entry [index, count, f,
+# length, step1, ..., steplength] of the flattened chain (see simp_aci).
+# simp appends the nodes to one reusable buffer, children before their
+# parents, and branches it drops are simply not referenced; compact_rect
+# then copies the nodes reachable from the result into the code kept with
+# a derivative, root first.
 
 TAG_ID          = 0
 TAG_RIGHT       = 1
@@ -519,99 +870,1396 @@ TAG_SEQ_EMPTY1  = 5
 TAG_SEQ_EMPTY2  = 6
 TAG_ERROR       = 7
 TAG_RECD        = 8
-
-class RectFun(object):
-    __slots__ = ('tag', 'sub1', 'sub2')
-    def __init__(self, tag, sub1=None, sub2=None):
-        self.tag = tag
-        self.sub1 = sub1
-        self.sub2 = sub2
-
-def apply_rectfun(rf, v):
-    t = rf.tag
-    if t == TAG_ID:
-        return v
-    elif t == TAG_RIGHT:
-        return Right(apply_rectfun(rf.sub1, v))
-    elif t == TAG_LEFT:
-        return Left(apply_rectfun(rf.sub1, v))
-    elif t == TAG_ALT:
-        if isinstance(v, Left):
-            return Left(apply_rectfun(rf.sub1, v.v))
-        elif isinstance(v, Right):
-            return Right(apply_rectfun(rf.sub2, v.v))
-        else:
-            raise Exception("Invalid value for TAG_ALT")
-    elif t == TAG_SEQ:
-        if not isinstance(v, Sequ):
-            raise Exception("Invalid value for TAG_SEQ (expected Sequ)")
-        v1r = apply_rectfun(rf.sub1, v.v1)
-        v2r = apply_rectfun(rf.sub2, v.v2)
-        return Sequ(v1r, v2r)
-    elif t == TAG_SEQ_EMPTY1:
-        empty_part = apply_rectfun(rf.sub1, Empty())
-        v2r = apply_rectfun(rf.sub2, v)
-        return Sequ(empty_part, v2r)
-    elif t == TAG_SEQ_EMPTY2:
-        empty_part = apply_rectfun(rf.sub2, Empty())
-        v1r = apply_rectfun(rf.sub1, v)
-        return Sequ(v1r, empty_part)
-    elif t == TAG_ERROR:
-        raise Exception("error")
-    elif t == TAG_RECD:
-        if not isinstance(v, Rec):
-            raise Exception("Invalid value for TAG_RECD (expected Rec)")
-        v_inner = apply_rectfun(rf.sub1, v.v)
-        return Rec(v.x, v_inner)
+TAG_ALTS        = 9
+
+# Steps of the path to an alternative of a flattened chain
+STEP_LEFT = 0
+STEP_RIGHT = 1
+
+# The shared identity and error nodes of the simp buffer
+RECT_ID = 0
+RECT_ERROR = 1
+
+class RectBuffer(object):
+    __slots__ = ('code',)
+
+    def __init__(self):
+        self.code = [TAG_ID, TAG_ERROR]
+
+    def reset(self):
+        del self.code[2:]
+
+RECT_BUFFER = RectBuffer()
+
+def rect_node(code, tag, f):
+    at = len(code)
+    code.append(tag)
+    code.append(f)
+    return at
+
+def rect_node2(code, tag, f1, f2):
+    at = len(code)
+    code.append(tag)
+    code.append(f1)
+    code.append(f2)
+    return at
+
+def compact_rect(src, i, dst):
+    # Copies node i of src and the nodes below it to the end of dst and
+    # returns its index there
+    t = src[i]
+    at = len(dst)
+    dst.append(t)
+    if t == TAG_ID or t == TAG_ERROR:
+        pass
+    elif t == TAG_RIGHT or t == TAG_LEFT or t == TAG_RECD:
+        dst.append(0)
+        dst[at + 1] = compact_rect(src, src[i + 1], dst)
+    elif t == TAG_ALTS:
+        n = src[i + 1]
+        dst.append(n)
+        for j in range(n):
+            dst.append(0)
+        for j in range(n):
+            e = src[i + 2 + j]
+            length = src[e + 3]
+            dst[at + 2 + j] = len(dst)
+            ea = len(dst)
+            dst.append(src[e])
+            dst.append(src[e + 1])
+            dst.append(0)
+            dst.append(length)
+            for k in range(length):
+                dst.append(src[e + 4 + k])
+            dst[ea + 2] = compact_rect(src, src[e + 2], dst)
     else:
-        raise Exception("Unknown rectification tag")
+        dst.append(0)
+        dst.append(0)
+        dst[at + 1] = compact_rect(src, src[i + 1], dst)
+        dst[at + 2] = compact_rect(src, src[i + 2], dst)
+    return at
+
+# Work items of apply_rectfun: BUILD_* wrap the value just built, an index
+# >= 0 is the second part of a sequence, still to be applied to the next
+# value on the input stack
+BUILD_LEFT = -1
+BUILD_RIGHT = -2
+BUILD_SEQ = -3
+BUILD_REC = -4
+
+def apply_rectfun(code, v):
+    work = []
+    inputs = []
+    results = []
+    labels = []
+    i = 0
+    while True:
+        # Apply node i to v, going down into single children in place
+        t = code[i]
+        if COUNTERS_BUILT and COUNTERS.enabled:
+            COUNTERS.count(C_RECT, 0 if t == TAG_ID else 1)
+        if t == TAG_ID:
+            pass
+        elif t == TAG_RIGHT:
+            work.append(BUILD_RIGHT)
+            i = code[i + 1]
+            continue
+        elif t == TAG_LEFT:
+            work.append(BUILD_LEFT)
+            i = code[i + 1]
+            continue
+        elif t == TAG_ALT:
+            if isinstance(v, Left):
+                work.append(BUILD_LEFT)
+                i = code[i + 1]
+                v = v.v
+            elif isinstance(v, Right):
+                work.append(BUILD_RIGHT)
+                i = code[i + 2]
+                v = v.v
+            else:
+                raise Exception("Invalid value for TAG_ALT")
+            continue
+        elif t == TAG_SEQ:
+            if not isinstance(v, Sequ):
+                raise Exception("Invalid value for TAG_SEQ (expected Sequ)")
+            work.append(BUILD_SEQ)
+            work.append(code[i + 2])
+            inputs.append(v.v2)
+            i = code[i + 1]
+            v = v.v1
+            continue
+        elif t == TAG_SEQ_EMPTY1:
+            work.append(BUILD_SEQ)
+            work.append(code[i + 2])
+            inputs.append(v)
+            i = code[i + 1]
+            v = Empty()
+            continue
+        elif t == TAG_SEQ_EMPTY2:
+            work.append(BUILD_SEQ)
+            work.append(code[i + 2])
+            inputs.append(Empty())
+            i = code[i + 1]
+            continue
+        elif t == TAG_ERROR:
+            raise Exception("error")
+        elif t == TAG_RECD:
+            if not isinstance(v, Rec):
+                raise Exception("Invalid value for TAG_RECD (expected Rec)")
+            labels.append(v.x)
+            work.append(BUILD_REC)
+            i = code[i + 1]
+            v = v.v
+            continue
+        elif t == TAG_ALTS:
+            # find the alternative of the flattened chain that v selects
+            n = code[i + 1]
+            j = 0
+            while j < n - 1:
+                if isinstance(v, Left):
+                    v = v.v
+                    break
+                elif isinstance(v, Right):
+                    v = v.v
+                    j += 1
+                else:
+                    raise Exception("Invalid value for TAG_ALTS")
+            e = code[i + 2 + j]
+            index = code[e]
+            if index < code[e + 1] - 1:
+                v = Left(v)
+            for k in range(index):
+                v = Right(v)
+            # the steps of the path are wrapped around the result, the
+            # last step first
+            for k in range(code[e + 3]):
+                if code[e + 4 + k] == STEP_LEFT:
+                    work.append(BUILD_LEFT)
+                else:
+                    work.append(BUILD_RIGHT)
+            i = code[e + 2]
+            continue
+        else:
+            raise Exception("Unknown rectification tag")
+        # v is the value built so far; wrap it until the second part of a
+        # sequence is reached
+        while True:
+            if len(work) == 0:
+                return v
+            k = work.pop()
+            if k >= 0:
+                results.append(v)
+                v = inputs.pop()
+                i = k
+                break
+            elif k == BUILD_LEFT:
+                v = Left(v)
+            elif k == BUILD_RIGHT:
+                v = Right(v)
+            elif k == BUILD_SEQ:
+                v = Sequ(results.pop(), v)
+            else:
+                v = Rec(labels.pop(), v)
 
 # Simplification function
 
 def simp(r):
+    RECT_BUFFER.reset()
+    rs, f = simp_into(r, RECT_BUFFER.code)
+    code = []
+    compact_rect(RECT_BUFFER.code, f, code)
+    return (rs, code)
+
+def simp_into(r, code):
+    if COUNTERS_BUILT and COUNTERS.enabled:
+        COUNTERS.count(C_SIMP, 1)
     if isinstance(r, ALT):
-        r1s, f1s = simp(r.r1)
-        r2s, f2s = simp(r.r2)
+        r1s, f1s = simp_into(r.r1, code)
+        r2s, f2s = simp_into(r.r2, code)
         if isinstance(r1s, ZERO):
-            return (r2s, RectFun(TAG_RIGHT, f2s))
+            return (r2s, rect_node(code, TAG_RIGHT, f2s))
         elif isinstance(r2s, ZERO):
-            return (r1s, RectFun(TAG_LEFT, f1s))
-        elif eq_rexp(r1s, r2s):
-            return (r1s, RectFun(TAG_LEFT, f1s))
+            return (r1s, rect_node(code, TAG_LEFT, f1s))
+        elif r1s is r2s:
+            return (r1s, rect_node(code, TAG_LEFT, f1s))
         else:
-            return (ALT(r1s, r2s), RectFun(TAG_ALT, f1s, f2s))
+            return (mk_alt(r1s, r2s), rect_node2(code, TAG_ALT, f1s, f2s))
     elif isinstance(r, SEQ):
-        r1s, f1s = simp(r.r1)
-        r2s, f2s = simp(r.r2)
+        r1s, f1s = simp_into(r.r1, code)
+        r2s, f2s = simp_into(r.r2, code)
         if isinstance(r1s, ZERO) or isinstance(r2s, ZERO):
-            return (ZERO(), RectFun(TAG_ERROR))
+            return (mk_zero(), RECT_ERROR)
         elif isinstance(r1s, ONE):
-            return (r2s, RectFun(TAG_SEQ_EMPTY1, f1s, f2s))
+            return (r2s, rect_node2(code, TAG_SEQ_EMPTY1, f1s, f2s))
         elif isinstance(r2s, ONE):
-            return (r1s, RectFun(TAG_SEQ_EMPTY2, f1s, f2s))
+            return (r1s, rect_node2(code, TAG_SEQ_EMPTY2, f1s, f2s))
         else:
-            return (SEQ(r1s, r2s), RectFun(TAG_SEQ, f1s, f2s))
+            return (mk_seq(r1s, r2s), rect_node2(code, TAG_SEQ, f1s, f2s))
     else:
-        return (r, RectFun(TAG_ID))
+        return (r, RECT_ID)
+
+# ACI simplification (opt-in, see set_simp_mode): nested alternatives are
+# flattened into one chain and ZEROs and later duplicates are removed from
+# it. The order of the alternatives is kept, since POSIX prefers the
+# leftmost alternative; for the same reason SEQ is not distributed over
+# alternatives.
+#
+# Each alternative of the chain gets an entry in the code: the Left/Right
+# steps leading to the subtree it came from, its position in the chain that
+# subtree simplified to, and the rectification of that subtree.
+
+def collect_alts(r, path, alts, entries, seen, code):
+    if isinstance(r, ALT):
+        path.append(STEP_LEFT)
+        collect_alts(r.r1, path, alts, entries, seen, code)
+        path[len(path) - 1] = STEP_RIGHT
+        collect_alts(r.r2, path, alts, entries, seen, code)
+        path.pop()
+        return
+    rs, f = simp_aci_into(r, code)
+    if isinstance(rs, ZERO):
+        return
+    # a subtree can simplify to a chain of its own, which is split up again
+    parts = []
+    while isinstance(rs, ALT):
+        parts.append(rs.r1)
+        rs = rs.r2
+    parts.append(rs)
+    count = len(parts)
+    for i in range(count):
+        part = parts[i]
+        if part not in seen:
+            seen[part] = True
+            alts.append(part)
+            entries.append(len(code))
+            code.append(i)
+            code.append(count)
+            code.append(f)
+            code.append(len(path))
+            for step in path:
+                code.append(step)
+
+def simp_aci(r):
+    RECT_BUFFER.reset()
+    rs, f = simp_aci_into(r, RECT_BUFFER.code)
+    code = []
+    compact_rect(RECT_BUFFER.code, f, code)
+    return (rs, code)
+
+def simp_aci_into(r, code):
+    if COUNTERS_BUILT and COUNTERS.enabled:
+        COUNTERS.count(C_SIMP, 1)
+    if isinstance(r, ALT):
+        alts = []
+        entries = []
+        seen = {}
+        collect_alts(r, [], alts, entries, seen, code)
+        if len(alts) == 0:
+            return (mk_zero(), RECT_ERROR)
+        chain = alts[len(alts) - 1]
+        i = len(alts) - 2
+        while i >= 0:
+            chain = mk_alt(alts[i], chain)
+            i -= 1
+        at = len(code)
+        code.append(TAG_ALTS)
+        code.append(len(entries))
+        for e in entries:
+            code.append(e)
+        return (chain, at)
+    elif isinstance(r, SEQ):
+        r1s, f1s = simp_aci_into(r.r1, code)
+        r2s, f2s = simp_aci_into(r.r2, code)
+        if isinstance(r1s, ZERO) or isinstance(r2s, ZERO):
+            return (mk_zero(), RECT_ERROR)
+        elif isinstance(r1s, ONE):
+            return (r2s, rect_node2(code, TAG_SEQ_EMPTY1, f1s, f2s))
+        elif isinstance(r2s, ONE):
+            return (r1s, rect_node2(code, TAG_SEQ_EMPTY2, f1s, f2s))
+        else:
+            return (mk_seq(r1s, r2s), rect_node2(code, TAG_SEQ, f1s, f2s))
+    else:
+        return (r, RECT_ID)
+
+# Derivative cache
+
+DERIV_CACHE_SIZE = 10000
+
+class DerivEntry(object):
+    __slots__ = ('r', 'rf')
+
+    def __init__(self, r, rf):
+        self.r = r
+        self.rf = rf
+
+class DerivCache(object):
+    """
+    Bounded cache of simplified derivatives keyed by (regex state, character).
+    Lexers pass the representative of the character's class (see
+    partition_for), so there is one entry per class rather than per
+    character. Derivatives are interned, so the states reached while lexing
+    are themselves cache keys and recurring states become hits. When the
+    cache is full it is flushed completely and warms up again, and the
+    intern table is cleared with it.
+    """
+    __slots__ = ('max_size', 'table', 'hits', 'misses', 'evictions')
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.table = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def der_simp(self, c, r):
+        key = (r, c)
+        if key in self.table:
+            self.hits += 1
+            return self.table[key]
+        self.misses += 1
+        if len(self.table) >= self.max_size or INTERN.size() >= INTERN_SIZE:
+            self.flush(r)
+        if COUNTERS_BUILT and COUNTERS.enabled:
+            r_simp, rf_simp = counted_der_simp(c, r)
+        elif OPTIONS.simp == SIMP_ACI:
+            r_simp, rf_simp = simp_aci(der(c, r))
+        else:
+            r_simp, rf_simp = simp(der(c, r))
+        entry = DerivEntry(r_simp, rf_simp)
+        self.table[key] = entry
+        return entry
+
+    def flush(self, r):
+        # The derivatives are only kept alive by the cache and by the states
+        # being lexed, so the intern table is cleared with it; r, the state
+        # being derived, keeps its identity
+        self.table.clear()
+        self.evictions += 1
+        INTERN.clear([r])
+        FIRST_CHARS.firsts.clear()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats_string(self):
+        total = self.hits + self.misses
+        ratio = 0.0
+        if total > 0:
+            ratio = 100.0 * self.hits / total
+        return "Derivative cache: %d hits, %d misses, %d evictions (%s%% hit rate)" % (
+            self.hits, self.misses, self.evictions, str(ratio))
+
+DERIV_CACHE = DerivCache(DERIV_CACHE_SIZE)
+
+class SizeTrace(object):
+    """
+    Records size() of the derivative after every lexed character when it is
+    enabled (--trace-sizes), to check that derivatives stay bounded.
+    """
+    __slots__ = ('enabled', 'sizes')
+
+    def __init__(self):
+        self.enabled = False
+        self.sizes = []
+
+    def record(self, r):
+        self.sizes.append(size(r))
+
+    def record_size(self, n):
+        self.sizes.append(n)
+
+    def reset(self):
+        self.sizes = []
+
+    def steps_string(self):
+        parts = []
+        for n in self.sizes:
+            parts.append(str(n))
+        return "Derivative sizes: " + " ".join(parts)
+
+    def stats_string(self):
+        if len(self.sizes) == 0:
+            return "Derivative size: no steps recorded"
+        largest = 0
+        total = 0
+        for n in self.sizes:
+            total += n
+            if n > largest:
+                largest = n
+        mean = float(total) / len(self.sizes)
+        return "Derivative size: max %d, mean %s, final %d over %d steps" % (
+            largest, str(mean), self.sizes[len(self.sizes) - 1], len(self.sizes))
+
+SIZE_TRACE = SizeTrace()
+
+# Hot-path counters (--count-calls): the calls of der, simp, apply_rectfun,
+# inj, mkeps, env and flatten, the nodes they allocate and the largest
+# derivative built. The checks test COUNTERS_BUILT first, a module constant:
+# the RPython target sets it to False at translation time unless
+# LEXER_COUNTERS=1 is set, and the counting code is then folded away.
+
+COUNTERS_BUILT = True
+
+C_DER = 0
+C_SIMP = 1
+C_RECT = 2
+C_INJ = 3
+C_MKEPS = 4
+C_ENV = 5
+C_FLATTEN = 6
+
+COUNTER_NAMES = ["der", "simp", "apply_rectfun", "inj", "mkeps", "env", "flatten"]
+
+# What the node counts are for each counter
+COUNTER_NODES = ["regex nodes", "regex nodes and rectifications", "values",
+                 "values", "values", "pairs", "strings"]
+
+class HotCounters(object):
+    __slots__ = ('enabled', 'calls', 'nodes', 'largest')
+
+    def __init__(self):
+        self.enabled = False
+        self.calls = [0] * len(COUNTER_NAMES)
+        self.nodes = [0] * len(COUNTER_NAMES)
+        self.largest = 0
+
+    def count(self, k, nodes):
+        self.calls[k] += 1
+        self.nodes[k] += nodes
+
+    def reset(self):
+        for k in range(len(COUNTER_NAMES)):
+            self.calls[k] = 0
+            self.nodes[k] = 0
+        self.largest = 0
+
+    def report_string(self):
+        lines = ["Hot-path counters:"]
+        for k in range(len(COUNTER_NAMES)):
+            lines.append("  %s: %d calls, %d %s" % (
+                COUNTER_NAMES[k], self.calls[k], self.nodes[k], COUNTER_NODES[k]))
+        lines.append("  largest derivative: %d nodes" % self.largest)
+        return "\n".join(lines)
+
+COUNTERS = HotCounters()
+
+def build_counters(built):
+    # Called by the RPython target before translation
+    global COUNTERS_BUILT
+    COUNTERS_BUILT = built
+
+def enable_counters():
+    if not COUNTERS_BUILT:
+        print("Hot-path counters are not built in (translate with LEXER_COUNTERS=1)")
+    COUNTERS.enabled = True
+
+def counted_der_simp(c, r):
+    # der and simp for DerivCache.der_simp, with the regex nodes they intern
+    # added to their counts
+    before = INTERN.size()
+    d = der(c, r)
+    COUNTERS.nodes[C_DER] += INTERN.size() - before
+    before = INTERN.size()
+    if OPTIONS.simp == SIMP_ACI:
+        r_simp, rf_simp = simp_aci(d)
+    else:
+        r_simp, rf_simp = simp(d)
+    COUNTERS.nodes[C_SIMP] += INTERN.size() - before
+    n = size(r_simp)
+    if n > COUNTERS.largest:
+        COUNTERS.largest = n
+    return (r_simp, rf_simp)
+
+# Lexing errors. Every lexer stops at the first dead derivative (ZERO),
+# from which nothing can be lexed whatever follows, and reports the offset
+# of the character that killed it, or the end of the input when the input
+# runs out in the middle of a token.
+
+class LexError(Exception):
+    __slots__ = ('offset',)
+
+    def __init__(self, offset):
+        self.offset = offset
+
+    def describe(self):
+        return "lexing error at offset %d" % self.offset
+
+    def __str__(self):
+        return self.describe()
+
+class ErrorLog(object):
+    """
+    The bad tokens of the recovery mode (--recover): instead of stopping at
+    the first error, the lexers record its offset and the text skipped and
+    go on lexing from the next whitespace character after it.
+    """
+    __slots__ = ('enabled', 'offsets', 'texts')
+
+    def __init__(self):
+        self.enabled = False
+        self.offsets = []
+        self.texts = []
+
+    def record(self, offset, text):
+        self.offsets.append(offset)
+        self.texts.append(text)
+
+    def count(self):
+        return len(self.offsets)
+
+    def reset(self):
+        self.offsets = []
+        self.texts = []
+
+    def report_string(self):
+        lines = []
+        for k in range(len(self.offsets)):
+            lines.append("lexing error at offset %d: skipped %s" % (
+                self.offsets[k], escape_text(self.texts[k])))
+        return "\n".join(lines)
+
+LEX_ERRORS = ErrorLog()
+
+# The label of the text skipped in the recovery mode. The lexers return the
+# skipped text as a lexeme with this label, which is dropped from the tokens
+# like whitespace, so that the offsets of the tokens after it stay right.
+ERROR_LABEL = "error"
+
+def enable_recovery():
+    LEX_ERRORS.enabled = True
+
+def escape_text(t):
+    parts = []
+    for c in t:
+        if c == "\n":
+            parts.append("\\n")
+        elif c == "\t":
+            parts.append("\\t")
+        elif ord(c) < 32 or ord(c) > 126:
+            digits = "0123456789abcdef"
+            parts.append("\\x" + digits[ord(c) >> 4] + digits[ord(c) & 15])
+        else:
+            parts.append(c)
+    return "\"" + "".join(parts) + "\""
+
+def dead_offset(r, classes, s, start):
+    # The offset of the character at which the derivatives of r from start
+    # die, len(s) if the input runs out first
+    i = start
+    while i < len(s):
+        r = DERIV_CACHE.der_simp(classes.representative(s[i]), r).r
+        if isinstance(r, ZERO):
+            return i
+        i += 1
+    return len(s)
+
+def safe_boundary(s, i):
+    # The first whitespace character at or after i
+    while i < len(s) and s[i] != " " and s[i] != "\t" and s[i] != "\n":
+        i += 1
+    return i
+
+def lex_error(s, start, offset, base):
+    """
+    No token can be lexed at start, because of the character at offset.
+    Raises the LexError, or in the recovery mode records it and returns
+    where lexing resumes. base is the offset of s in the whole source.
+    """
+    if not LEX_ERRORS.enabled:
+        raise LexError(base + offset)
+    resume = safe_boundary(s, offset)
+    LEX_ERRORS.record(base + offset, s[start:resume])
+    return resume
 
 # Lexing function
 def lex_simp(r, s):
-    if not s:
+    # Forward phase: the derivative before each character and the entry
+    # holding its simplified derivative are kept in explicit arrays
+    classes = partition_for(r)
+    n = len(s)
+    states = [r] * n
+    entries = [None] * n
+    i = 0
+    while i < n:
+        states[i] = r
+        entry = DERIV_CACHE.der_simp(classes.representative(s[i]), r)
+        entries[i] = entry
+        r = entry.r
+        if isinstance(r, ZERO):
+            raise LexError(i)
+        i += 1
+        if SIZE_TRACE.enabled:
+            SIZE_TRACE.record(r)
+    if not nullable(r):
+        raise LexError(n)
+    v = mkeps(r)
+    # Backward phase: rectify and inject the characters in reverse order
+    i = n - 1
+    while i >= 0:
+        entry = entries[i]
+        v = inj(states[i], s[i], apply_rectfun(entry.rf, v))
+        i -= 1
+    return v
+
+def lexing_simp(r, s):
+    val_result = lex_simp(r, s)
+    return env(val_result)
+
+# Maximal munch: the STAR over the token records is lexed one token at a
+# time. Each token is the longest prefix the record alternatives match, and
+# its derivatives start again from the token regex, so they stay small and
+# the value of a token can be dropped once its pairs are collected.
+def munch_forward(r, classes, s, start, states, entries):
+    # Forward phase: derive until the derivative is dead or the input ends,
+    # recording the states and cache entries; returns the last offset at
+    # which the derivative was nullable, -1 if there is none
+    n = len(s)
+    end = -1
+    i = start
+    while i < n:
+        states.append(r)
+        entry = DERIV_CACHE.der_simp(classes.representative(s[i]), r)
+        entries.append(entry)
+        r = entry.r
+        i += 1
+        if SIZE_TRACE.enabled:
+            SIZE_TRACE.record(r)
+        if isinstance(r, ZERO):
+            break
         if nullable(r):
-            return mkeps(r)
+            end = i
+    return end
+
+def munch_value(s, start, end, states, entries):
+    # Backward phase over the longest match only
+    k = end - start - 1
+    v = mkeps(entries[k].r)
+    while k >= 0:
+        entry = entries[k]
+        v = inj(states[k], s[start + k], apply_rectfun(entry.rf, v))
+        k -= 1
+    return v
+
+def lexing_munch(r, s):
+    assert isinstance(r, STAR)
+    classes = partition_for(r.r)
+    result = []
+    start = 0
+    while start < len(s):
+        states = []
+        entries = []
+        end = munch_forward(r.r, classes, s, start, states, entries)
+        if end < 0:
+            resume = lex_error(s, start, dead_offset(r.r, classes, s, start), 0)
+            result.append((ERROR_LABEL, s[start:resume]))
+            start = resume
+            continue
+        env_into(munch_value(s, start, end, states, entries), result)
+        start = end
+    return result
+
+# Recognition-only lexing: maximal munch as in the munch mode, using only
+# derivatives and nullable. The forward pass finds where the longest match
+# ends; the label is that of the first record whose regex matches the
+# lexeme, which is the record the POSIX value of the lexeme would select,
+# and the text is sliced from the input. No values are built and no
+# rectification is applied.
+
+def record_list(r):
+    # The records of an alternative of records, in order
+    records = []
+    while isinstance(r, ALT):
+        records.append(r.r1)
+        r = r.r2
+    records.append(r)
+    return records
+
+def recognise_end(r, classes, s, start):
+    # The end of the longest match of r from start, -1 if there is none
+    n = len(s)
+    end = -1
+    i = start
+    while i < n:
+        r = DERIV_CACHE.der_simp(classes.representative(s[i]), r).r
+        i += 1
+        if SIZE_TRACE.enabled:
+            SIZE_TRACE.record(r)
+        if isinstance(r, ZERO):
+            break
+        if nullable(r):
+            end = i
+    return end
+
+class RecordStart(object):
+    # A record that does not die on the first character of a lexeme: its
+    # label and the derivative of its regex by that character
+    __slots__ = ('x', 'r')
+
+    def __init__(self, x, r):
+        self.x = x
+        self.r = r
+
+def record_starts(records, c, starts):
+    # The records that do not die on the class representative c, in order;
+    # computed once per class and kept in starts
+    found = starts.get(c, None)
+    if found is None:
+        found = []
+        for record in records:
+            assert isinstance(record, RECD)
+            d = DERIV_CACHE.der_simp(c, record.r).r
+            if not isinstance(d, ZERO):
+                found.append(RecordStart(record.x, d))
+        starts[c] = found
+    return found
+
+def matches_lexeme(r, classes, s, start, end):
+    i = start
+    while i < end:
+        r = DERIV_CACHE.der_simp(classes.representative(s[i]), r).r
+        if isinstance(r, ZERO):
+            return False
+        i += 1
+    return nullable(r)
+
+def lexing_recognise(r, s):
+    assert isinstance(r, STAR)
+    classes = partition_for(r.r)
+    records = record_list(r.r)
+    starts = {}
+    result = []
+    start = 0
+    while start < len(s):
+        end = recognise_end(r.r, classes, s, start)
+        if end < 0:
+            resume = lex_error(s, start, dead_offset(r.r, classes, s, start), 0)
+            result.append((ERROR_LABEL, s[start:resume]))
+            start = resume
+            continue
+        c = classes.representative(s[start])
+        for first in record_starts(records, c, starts):
+            if matches_lexeme(first.r, classes, s, start + 1, end):
+                result.append((first.x, s[start:end]))
+                break
+        start = end
+    return result
+
+# Antimirov partial derivatives. The partial derivative of a regex by a
+# character is a set of terms whose alternative is its derivative; every term
+# is a sequence of subexpressions of the original regex, so the number of
+# different terms is bounded by the size of the regex (Antimirov 1996) and
+# stepping a set of terms costs a bounded amount per character, where a
+# Brzozowski derivative can keep growing even after simp. The antimirov mode
+# lexes with maximal munch as the munch mode does, keeping a set of terms for
+# each token record, so the longest match and the first record matching it
+# are found by stepping the sets, without building values.
+
+PDERIV_CACHE_SIZE = 10000
+
+def seq_term(t, r):
+    # The term t followed by r, with sequences nested to the right so that
+    # equal terms are the same interned regex
+    if isinstance(t, ONE):
+        return r
+    elif isinstance(t, SEQ):
+        return mk_seq(t.r1, seq_term(t.r2, r))
+    return mk_seq(t, r)
+
+def add_term(t, terms, seen):
+    if t not in seen:
+        seen[t] = True
+        terms.append(t)
+
+def add_seq_terms(c, r1, r2, terms, seen):
+    # The partial derivatives of r1 by c, each followed by r2
+    first = []
+    pder(c, r1, first, {})
+    for t in first:
+        add_term(seq_term(t, r2), terms, seen)
+
+def pder(c, r, terms, seen):
+    """Adds the partial derivatives of r by c to terms, in order."""
+    if isinstance(r, CHAR):
+        if r.c == c:
+            add_term(mk_one(), terms, seen)
+    elif isinstance(r, RANGE):
+        if r.contains(c):
+            add_term(mk_one(), terms, seen)
+    elif isinstance(r, ALT):
+        pder(c, r.r1, terms, seen)
+        pder(c, r.r2, terms, seen)
+    elif isinstance(r, SEQ):
+        add_seq_terms(c, r.r1, r.r2, terms, seen)
+        if r.r1.is_nullable:
+            pder(c, r.r2, terms, seen)
+    elif isinstance(r, STAR):
+        add_seq_terms(c, r.r, r, terms, seen)
+    elif isinstance(r, PLUS):
+        add_seq_terms(c, r.r, mk_star(r.r), terms, seen)
+    elif isinstance(r, OPTIONAL):
+        pder(c, r.r, terms, seen)
+    elif isinstance(r, NTIMES):
+        if r.n > 0:
+            rest = mk_ntimes(r.r, r.n - 1)
+            add_seq_terms(c, r.r, rest, terms, seen)
+            if r.r.is_nullable:
+                pder(c, rest, terms, seen)
+    elif isinstance(r, RECD):
+        pder(c, r.r, terms, seen)
+
+class PartialDerivCache(object):
+    """
+    Bounded cache of the partial derivatives of a term by a character class
+    representative, flushed completely when it is full, like DERIV_CACHE.
+    """
+    __slots__ = ('max_size', 'table')
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.table = {}
+
+    def pders(self, c, r):
+        key = (r, c)
+        terms = self.table.get(key, None)
+        if terms is None:
+            if len(self.table) >= self.max_size:
+                self.table.clear()
+            terms = []
+            pder(c, r, terms, {})
+            self.table[key] = terms
+        return terms
+
+PDERIV_CACHE = PartialDerivCache(PDERIV_CACHE_SIZE)
+
+class RecordTerms(object):
+    # A token record that is still alive: its label and the set of terms
+    # its regex has been stepped to
+    __slots__ = ('x', 'terms')
+
+    def __init__(self, x, terms):
+        self.x = x
+        self.terms = terms
+
+def step_terms(c, terms):
+    # The union of the partial derivatives of the terms by c, in order
+    result = []
+    seen = {}
+    for t in terms:
+        for d in PDERIV_CACHE.pders(c, t):
+            add_term(d, result, seen)
+    return result
+
+def terms_nullable(terms):
+    for t in terms:
+        if t.is_nullable:
+            return True
+    return False
+
+def terms_size(live):
+    n = 0
+    for record in live:
+        for t in record.terms:
+            n += size(t)
+    return n
+
+def antimirov_token(initial, classes, s, start):
+    # The end of the longest match from start, -1 if there is none, and the
+    # label of the first record matching it
+    n = len(s)
+    end = -1
+    label = ""
+    live = initial
+    i = start
+    while i < n and len(live) > 0:
+        c = classes.representative(s[i])
+        stepped = []
+        for record in live:
+            terms = step_terms(c, record.terms)
+            if len(terms) > 0:
+                stepped.append(RecordTerms(record.x, terms))
+        live = stepped
+        i += 1
+        if SIZE_TRACE.enabled:
+            SIZE_TRACE.record_size(terms_size(live))
+        for record in live:
+            if terms_nullable(record.terms):
+                end = i
+                label = record.x
+                break
+    return end, label
+
+def lexing_antimirov(r, s):
+    assert isinstance(r, STAR)
+    classes = partition_for(r.r)
+    initial = []
+    for record in record_list(r.r):
+        assert isinstance(record, RECD)
+        initial.append(RecordTerms(record.x, [record.r]))
+    result = []
+    start = 0
+    while start < len(s):
+        end, label = antimirov_token(initial, classes, s, start)
+        if end < 0:
+            resume = lex_error(s, start, dead_offset(r.r, classes, s, start), 0)
+            result.append((ERROR_LABEL, s[start:resume]))
+            start = resume
+            continue
+        result.append((label, s[start:end]))
+        start = end
+    return result
+
+# Bit-coded derivatives (Sulzmann & Lu). The lexing decisions are recorded
+# as bit sequences on annotated regular expressions during the forward pass,
+# and the tokens are decoded from the final bit sequence directly, without
+# rectification, injection or any Val tree.
+
+BIT_Z = 0
+BIT_S = 1
+
+class Bits(object):
+    # Persistent bit sequence: a leaf holds one bit, an inner node the
+    # concatenation of its two halves, so fusing bits never copies them
+    __slots__ = ('bit', 'left', 'right')
+
+    def __init__(self, bit, left, right):
+        self.bit = bit
+        self.left = left
+        self.right = right
+
+BITS_Z = Bits(BIT_Z, None, None)
+BITS_S = Bits(BIT_S, None, None)
+
+def bits_cat(bs1, bs2):
+    if bs1 is None:
+        return bs2
+    if bs2 is None:
+        return bs1
+    return Bits(-1, bs1, bs2)
+
+def bits_to_list(bs):
+    result = []
+    stack = []
+    if bs is not None:
+        stack.append(bs)
+    while stack:
+        b = stack.pop()
+        if b.left is None:
+            result.append(b.bit)
         else:
-            raise Exception("lexing error")
+            stack.append(b.right)
+            stack.append(b.left)
+    return result
+
+# Annotated regular expressions; every node keeps its bits and its erasure
+# as an interned Rexp, used for nullable tests and to remove duplicates.
+# The erasure is computed once, when the node is built: the compound nodes
+# take it from callers that already have it (fuse only changes the bits)
+class ARexp(object):
+    __slots__ = ('bs', 'er')
+
+class AZERO(ARexp):
+    __slots__ = ()
+
+    def __init__(self):
+        self.bs = None
+        self.er = mk_zero()
+
+class AONE(ARexp):
+    __slots__ = ()
+
+    def __init__(self, bs):
+        self.bs = bs
+        self.er = mk_one()
+
+class ACHAR(ARexp):
+    __slots__ = ('c',)
+
+    def __init__(self, bs, c):
+        self.bs = bs
+        self.c = c
+        self.er = mk_char(c)
+
+class ARANGE(ARexp):
+    __slots__ = ('cs',)
+
+    def __init__(self, bs, cs):
+        self.bs = bs
+        self.cs = cs
+        self.er = mk_range(cs)
+
+class ASEQ(ARexp):
+    __slots__ = ('r1', 'r2')
+
+    def __init__(self, bs, r1, r2, er=None):
+        self.bs = bs
+        self.r1 = r1
+        self.r2 = r2
+        if er is None:
+            er = mk_seq(r1.er, r2.er)
+        self.er = er
+
+class AALTS(ARexp):
+    __slots__ = ('rs',)
+
+    def __init__(self, bs, rs, er=None):
+        self.bs = bs
+        self.rs = rs
+        if er is None:
+            er = rs[len(rs) - 1].er
+            i = len(rs) - 2
+            while i >= 0:
+                er = mk_alt(rs[i].er, er)
+                i -= 1
+        self.er = er
+
+class ASTAR(ARexp):
+    __slots__ = ('r',)
+
+    def __init__(self, bs, r, er=None):
+        self.bs = bs
+        self.r = r
+        if er is None:
+            er = mk_star(r.er)
+        self.er = er
+
+class ANTIMES(ARexp):
+    # n > 0 iterations of r, kept with a counter rather than unrolled into
+    # the sequence of n copies of r
+    __slots__ = ('r', 'n')
+
+    def __init__(self, bs, r, n, er=None):
+        self.bs = bs
+        self.r = r
+        self.n = n
+        if er is None:
+            er = mk_ntimes(r.er, n)
+        self.er = er
+
+AZERO_NODE = AZERO()
+
+def fuse(bs, r):
+    if bs is None or isinstance(r, AZERO):
+        return r
+    new_bs = bits_cat(bs, r.bs)
+    if isinstance(r, AONE):
+        return AONE(new_bs)
+    elif isinstance(r, ACHAR):
+        return ACHAR(new_bs, r.c)
+    elif isinstance(r, ARANGE):
+        return ARANGE(new_bs, r.cs)
+    elif isinstance(r, ASEQ):
+        return ASEQ(new_bs, r.r1, r.r2, r.er)
+    elif isinstance(r, AALTS):
+        return AALTS(new_bs, r.rs, r.er)
+    elif isinstance(r, ASTAR):
+        return ASTAR(new_bs, r.r, r.er)
+    elif isinstance(r, ANTIMES):
+        return ANTIMES(new_bs, r.r, r.n, r.er)
     else:
-        c = s[0]
-        cs = s[1:]
-        r_simp, rf_simp = simp(der(c, r))
-        val_sub = lex_simp(r_simp, cs)
-        rect_val = apply_rectfun(rf_simp, val_sub)
-        return inj(r, c, rect_val)
+        raise Exception("Unknown annotated regular expression type")
 
-def lexing_simp(r, s):
-    val_result = lex_simp(r, list(s))
-    return env(val_result)
+# PLUS and OPTIONAL are expressed with the core constructors, NTIMES keeps
+# its counter (ANTIMES) and records are transparent; decode_env mirrors
+# exactly this translation
+def internalise(r):
+    if isinstance(r, ZERO):
+        return AZERO_NODE
+    elif isinstance(r, ONE):
+        return AONE(None)
+    elif isinstance(r, CHAR):
+        return ACHAR(None, r.c)
+    elif isinstance(r, RANGE):
+        return ARANGE(None, r.cs)
+    elif isinstance(r, ALT):
+        return AALTS(None, [fuse(BITS_Z, internalise(r.r1)), fuse(BITS_S, internalise(r.r2))])
+    elif isinstance(r, SEQ):
+        return ASEQ(None, internalise(r.r1), internalise(r.r2))
+    elif isinstance(r, STAR):
+        return ASTAR(None, internalise(r.r))
+    elif isinstance(r, PLUS):
+        ar = internalise(r.r)
+        return ASEQ(None, ar, ASTAR(None, ar))
+    elif isinstance(r, OPTIONAL):
+        return AALTS(None, [fuse(BITS_Z, internalise(r.r)), AONE(BITS_S)])
+    elif isinstance(r, NTIMES):
+        if r.n == 0:
+            return AONE(None)
+        return ANTIMES(None, internalise(r.r), r.n)
+    elif isinstance(r, RECD):
+        return internalise(r.r)
+    else:
+        raise Exception("Unknown regular expression type")
+
+def bmkeps(r):
+    if isinstance(r, AONE):
+        return r.bs
+    elif isinstance(r, AALTS):
+        for r1 in r.rs:
+            if nullable(r1.er):
+                return bits_cat(r.bs, bmkeps(r1))
+        raise Exception("bmkeps of a non-nullable alternative")
+    elif isinstance(r, ASEQ):
+        return bits_cat(r.bs, bits_cat(bmkeps(r.r1), bmkeps(r.r2)))
+    elif isinstance(r, ASTAR):
+        return bits_cat(r.bs, BITS_S)
+    elif isinstance(r, ANTIMES):
+        bs = r.bs
+        for i in range(r.n):
+            bs = bits_cat(bs, bmkeps(r.r))
+        return bs
+    else:
+        raise Exception("bmkeps of a non-nullable regular expression")
+
+def bder(c, r):
+    if isinstance(r, ACHAR):
+        if r.c == c:
+            return AONE(r.bs)
+        return AZERO_NODE
+    elif isinstance(r, ARANGE):
+        rng = r.er
+        assert isinstance(rng, RANGE)
+        if rng.contains(c):
+            return AONE(r.bs)
+        return AZERO_NODE
+    elif isinstance(r, AALTS):
+        # alternatives that die on c are dropped straight away rather than
+        # being built only for bsimp to remove them again, and those that
+        # cannot start with c are not derived at all
+        rs = []
+        for r1 in r.rs:
+            if c not in FIRST_CHARS.get(r1.er):
+                continue
+            d1 = bder(c, r1)
+            if not isinstance(d1, AZERO):
+                rs.append(d1)
+        if len(rs) == 0:
+            return AZERO_NODE
+        return AALTS(r.bs, rs)
+    elif isinstance(r, ASEQ):
+        d1 = bder(c, r.r1)
+        if nullable(r.r1.er):
+            d2 = bder(c, r.r2)
+            if isinstance(d1, AZERO):
+                return fuse(bits_cat(r.bs, bmkeps(r.r1)), d2)
+            if isinstance(d2, AZERO):
+                return ASEQ(r.bs, d1, r.r2)
+            return AALTS(r.bs, [ASEQ(None, d1, r.r2), fuse(bmkeps(r.r1), d2)])
+        if isinstance(d1, AZERO):
+            return AZERO_NODE
+        return ASEQ(r.bs, d1, r.r2)
+    elif isinstance(r, ASTAR):
+        d = bder(c, r.r)
+        if isinstance(d, AZERO):
+            return AZERO_NODE
+        star = r
+        if r.bs is not None:
+            star = ASTAR(None, r.r, r.er)
+        return ASEQ(r.bs, fuse(BITS_Z, d), star)
+    elif isinstance(r, ANTIMES):
+        # the first iteration followed by the others, as in the sequence of
+        # n copies of r, which gives the same bits
+        if r.n == 1:
+            return bder(c, fuse(r.bs, r.r))
+        return bder(c, ASEQ(r.bs, r.r, ANTIMES(None, r.r, r.n - 1)))
+    else:
+        return AZERO_NODE
+
+def bsimp(r):
+    if isinstance(r, ASEQ):
+        r1s = bsimp(r.r1)
+        r2s = bsimp(r.r2)
+        if isinstance(r1s, AZERO) or isinstance(r2s, AZERO):
+            return AZERO_NODE
+        elif isinstance(r1s, AONE):
+            return fuse(bits_cat(r.bs, r1s.bs), r2s)
+        elif r1s is r.r1 and r2s is r.r2:
+            return r
+        return ASEQ(r.bs, r1s, r2s)
+    elif isinstance(r, AALTS):
+        # flatten nested alternatives, drop ZEROs and keep the first of
+        # several alternatives with the same erasure (POSIX priority)
+        rs = []
+        seen = {}
+        changed = False
+        for r1 in r.rs:
+            r1s = bsimp(r1)
+            if isinstance(r1s, AALTS):
+                changed = True
+                for r2 in r1s.rs:
+                    if r2.er not in seen:
+                        seen[r2.er] = True
+                        rs.append(fuse(r1s.bs, r2))
+            elif not isinstance(r1s, AZERO) and r1s.er not in seen:
+                seen[r1s.er] = True
+                rs.append(r1s)
+                if r1s is not r1:
+                    changed = True
+            else:
+                changed = True
+        if len(rs) == 0:
+            return AZERO_NODE
+        elif len(rs) == 1:
+            return fuse(r.bs, rs[0])
+        elif not changed:
+            return r
+        return AALTS(r.bs, rs)
+    else:
+        return r
+
+class BitDecoder(object):
+    # Walks the original regex guided by the bits, consuming characters of
+    # the input and collecting the (record, text) pairs that env returns
+    __slots__ = ('bits', 'bi', 's', 'si', 'result')
+
+    def __init__(self, bits, s):
+        self.bits = bits
+        self.bi = 0
+        self.s = s
+        self.si = 0
+        self.result = []
+
+    def next_bit(self):
+        if self.bi >= len(self.bits):
+            raise Exception("decoding error")
+        b = self.bits[self.bi]
+        self.bi += 1
+        return b
+
+    def decode(self, r):
+        if isinstance(r, ONE):
+            return
+        elif isinstance(r, CHAR) or isinstance(r, RANGE):
+            self.si += 1
+        elif isinstance(r, ALT):
+            if self.next_bit() == BIT_Z:
+                self.decode(r.r1)
+            else:
+                self.decode(r.r2)
+        elif isinstance(r, SEQ):
+            self.decode(r.r1)
+            self.decode(r.r2)
+        elif isinstance(r, STAR):
+            while self.next_bit() == BIT_Z:
+                self.decode(r.r)
+        elif isinstance(r, PLUS):
+            self.decode(r.r)
+            while self.next_bit() == BIT_Z:
+                self.decode(r.r)
+        elif isinstance(r, OPTIONAL):
+            if self.next_bit() == BIT_Z:
+                self.decode(r.r)
+        elif isinstance(r, NTIMES):
+            for i in range(r.n):
+                self.decode(r.r)
+        elif isinstance(r, RECD):
+            k = len(self.result)
+            self.result.append((r.x, ""))
+            start = self.si
+            self.decode(r.r)
+            self.result[k] = (r.x, self.s[start:self.si])
+        else:
+            raise Exception("decoding error")
+
+def decode_env(r, bits, s):
+    decoder = BitDecoder(bits, s)
+    decoder.decode(r)
+    if decoder.bi != len(bits) or decoder.si != len(s):
+        raise Exception("decoding error")
+    return decoder.result
+
+def lexing_bits(r, s):
+    a = internalise(r)
+    i = 0
+    while i < len(s):
+        a = bsimp(bder(s[i], a))
+        if isinstance(a, AZERO):
+            raise LexError(i)
+        if INTERN.size() >= INTERN_SIZE:
+            DERIV_CACHE.flush(a.er)
+        i += 1
+    if not nullable(a.er):
+        raise LexError(len(s))
+    return decode_env(r, bits_to_list(bmkeps(a)), s)
+
+# Lexing modes, selected at start-up with set_lexing_mode
+
+MODE_SIMP = 0
+MODE_BITS = 1
+MODE_MUNCH = 2
+MODE_RECOGNISE = 3
+MODE_ANTIMIROV = 4
+
+SIMP_BASIC = 0
+SIMP_ACI = 1
+
+KEYWORDS_REGEX_MODE = 0
+KEYWORDS_LOOKUP = 1
+
+class LexerOptions(object):
+    __slots__ = ('mode', 'simp', 'keywords')
+
+    def __init__(self):
+        self.mode = MODE_SIMP
+        self.simp = SIMP_BASIC
+        self.keywords = KEYWORDS_REGEX_MODE
+
+OPTIONS = LexerOptions()
+
+def set_lexing_mode(name):
+    if name == "simp":
+        OPTIONS.mode = MODE_SIMP
+    elif name == "bits":
+        OPTIONS.mode = MODE_BITS
+    elif name == "munch":
+        OPTIONS.mode = MODE_MUNCH
+    elif name == "recognise":
+        OPTIONS.mode = MODE_RECOGNISE
+    elif name == "antimirov":
+        OPTIONS.mode = MODE_ANTIMIROV
+    else:
+        raise Exception("Unknown lexing mode: " + name)
+
+def set_simp_mode(name):
+    if name == "basic":
+        OPTIONS.simp = SIMP_BASIC
+    elif name == "aci":
+        OPTIONS.simp = SIMP_ACI
+    else:
+        raise Exception("Unknown simplification mode: " + name)
+    # cached derivatives were simplified the other way
+    DERIV_CACHE.table.clear()
+
+def set_keyword_mode(name):
+    if name == "regex":
+        OPTIONS.keywords = KEYWORDS_REGEX_MODE
+    elif name == "lookup":
+        OPTIONS.keywords = KEYWORDS_LOOKUP
+    else:
+        raise Exception("Unknown keyword mode: " + name)
+
+def enable_size_trace():
+    SIZE_TRACE.enabled = True
+
+def lexing(r, s):
+    if OPTIONS.mode == MODE_MUNCH:
+        return lexing_munch(r, s)
+    elif OPTIONS.mode == MODE_RECOGNISE:
+        return lexing_recognise(r, s)
+    elif OPTIONS.mode == MODE_ANTIMIROV:
+        return lexing_antimirov(r, s)
+    try:
+        if OPTIONS.mode == MODE_BITS:
+            return lexing_bits(r, s)
+        return lexing_simp(r, s)
+    except LexError:
+        if not LEX_ERRORS.enabled:
+            raise
+        # The whole-source modes cannot resume after an error, so a source
+        # with errors is lexed again one token at a time
+        return lexing_munch(r, s)
 
 # The Lexing Rules for the FUN Language
 
@@ -725,7 +2373,99 @@ RIGHT_BRACE_RECORD = RECD("br", RIGHT_BRACE_REGEX)
 COMMENTS_RECORD = RECD("w", ALT(COMMENT_REGEX, WHITESPACE_REGEX))
 
 # Define regex for the FUN language
-FUN_REGEX = STAR(ALT(KEWORD_RECORD, ALT(ID_RECORD, ALT(TYPE_RECORD, ALT(CONST_RECORD, ALT(STRING_RECORD, ALT(OPERATOR_RECORD, ALT(INT_RECORD, ALT(DOUBLE_RECORD, ALT(SEMICOLON_RECORD, ALT(COLON_RECORD, ALT(CHAR_LITERAL_RECORD, ALT(COMMA_RECORD, ALT(LEFT_PAREN_RECORD, ALT(RIGHT_PAREN_RECORD, ALT(LEFT_BRACE_RECORD, ALT(RIGHT_BRACE_RECORD, COMMENTS_RECORD)))))))))))))))))
+FUN_REGEX = intern_rexp(STAR(ALT(KEWORD_RECORD, ALT(ID_RECORD, ALT(TYPE_RECORD, ALT(CONST_RECORD, ALT(STRING_RECORD, ALT(OPERATOR_RECORD, ALT(INT_RECORD, ALT(DOUBLE_RECORD, ALT(SEMICOLON_RECORD, ALT(COLON_RECORD, ALT(CHAR_LITERAL_RECORD, ALT(COMMA_RECORD, ALT(LEFT_PAREN_RECORD, ALT(RIGHT_PAREN_RECORD, ALT(LEFT_BRACE_RECORD, ALT(RIGHT_BRACE_RECORD, COMMENTS_RECORD))))))))))))))))))
+
+# Keyword lookup (--keywords=lookup): the keyword record is left out of the
+# language regex, so the spelled-out keywords no longer widen every
+# derivative next to the identifiers, and a lexeme that spells a keyword is
+# classified as one when its token is added (see TokenBuffer.add). The
+# keyword record is the first alternative, so POSIX gives it every lexeme
+# it matches whatever other record matches it too, and every keyword is
+# matched by another record, so no token boundary changes.
+
+def regex_words(r):
+    # The words of a regex built from CHAR, ONE, SEQ and ALT only
+    if isinstance(r, CHAR):
+        return [r.c]
+    elif isinstance(r, ONE):
+        return [""]
+    elif isinstance(r, ALT):
+        return regex_words(r.r1) + regex_words(r.r2)
+    elif isinstance(r, SEQ):
+        words = []
+        for w1 in regex_words(r.r1):
+            for w2 in regex_words(r.r2):
+                words.append(w1 + w2)
+        return words
+    raise Exception("Not a finite list of words")
+
+class KeywordTable(object):
+    """
+    Perfect hash table of the keywords. A word goes to the slot given by
+    h = (h * a + ord(c)) % size over its characters; a and size are
+    searched for when the table is built so that no two keywords share a
+    slot, and a lookup is one hash and one string comparison.
+    """
+    __slots__ = ('words', 'a', 'size')
+
+    def __init__(self, words):
+        size = len(words)
+        while size <= 4 * len(words):
+            a = 2
+            while a < 256:
+                if self.fill(words, a, size):
+                    return
+                a += 1
+            size += 1
+        raise Exception("No perfect hash for the keywords")
+
+    def fill(self, words, a, size):
+        self.a = a
+        self.size = size
+        self.words = [""] * size
+        for w in words:
+            h = self.slot(w)
+            if self.words[h] != "" and self.words[h] != w:
+                return False
+            self.words[h] = w
+        return True
+
+    def slot(self, w):
+        h = 0
+        for c in w:
+            h = (h * self.a + ord(c)) % self.size
+        return h
+
+    def contains(self, w):
+        if len(w) == 0:
+            return False
+        return self.words[self.slot(w)] == w
+
+def without_keywords(r, words):
+    # The language regex without its first record, the keywords
+    assert isinstance(r, STAR)
+    alts = r.r
+    assert isinstance(alts, ALT)
+    first = alts.r1
+    assert isinstance(first, RECD)
+    if first.x != "k":
+        raise Exception("The keyword record must come first")
+    rest = alts.r2
+    for w in words:
+        if not nullable(ders(rest, w)):
+            raise Exception("Keyword not matched by another record: " + w)
+    return mk_star(rest)
+
+KEYWORD_WORDS = regex_words(KEYWORDS_REGEX)
+KEYWORD_TABLE = KeywordTable(KEYWORD_WORDS)
+FUN_REGEX_NO_KEYWORDS = without_keywords(FUN_REGEX, KEYWORD_WORDS)
+keep_interned(FUN_REGEX)
+keep_interned(FUN_REGEX_NO_KEYWORDS)
+
+def language_regex():
+    if OPTIONS.keywords == KEYWORDS_LOOKUP:
+        return FUN_REGEX_NO_KEYWORDS
+    return FUN_REGEX
 
 # Tokens for the fun language
 
@@ -919,13 +2659,515 @@ def token(pair):
         return None
 
 def tokenise(s):
-    lexed = lexing_simp(FUN_REGEX, s)
-    result = []
-    for pair in lexed:
-        tk = token(pair)
-        if tk is not None:
-            result.append(tk)
-    return result
+    return pack_tokens(lexing(language_regex(), s))
+
+
+# Packed tokens. The parsers read a token through its kind, a small integer,
+# and an integer payload instead of through a token object: the payload is
+# the value of an integer or the code of a character literal, the symbol id
+# of an identifier or constant name, and an index into the string table of
+# the buffer for the kinds from K_TYPE to K_KWD. A double is kept as its
+# spelling.
+
+K_NONE = -1  # past the last token
+K_SEMI = 0
+K_COLON = 1
+K_COMMA = 2
+K_LPAREN = 3
+K_RPAREN = 4
+K_LBRACE = 5
+K_RBRACE = 6
+K_CHAR = 7
+K_INT = 8
+K_TYPE = 9
+K_STRING = 10
+K_OP = 11
+K_DOUBLE = 12
+K_KWD = 13
+K_ID = 14
+K_CONST = 15
+
+def token_kind(label):
+    """Kind of the tokens of a record label, or K_NONE for whitespace and comments."""
+    if label == "k":
+        return K_KWD
+    elif label == "i":
+        return K_ID
+    elif label == "t":
+        return K_TYPE
+    elif label == "ct":
+        return K_CONST
+    elif label == "cr":
+        return K_CHAR
+    elif label == "o":
+        return K_OP
+    elif label == "str":
+        return K_STRING
+    elif label == "int":
+        return K_INT
+    elif label == "d":
+        return K_DOUBLE
+    elif label == "s":
+        return K_SEMI
+    elif label == "cl":
+        return K_COLON
+    elif label == "c":
+        return K_COMMA
+    elif label == "pl":
+        return K_LPAREN
+    elif label == "pr":
+        return K_RPAREN
+    elif label == "bl":
+        return K_LBRACE
+    elif label == "br":
+        return K_RBRACE
+    else:
+        return K_NONE
+
+class SymbolTable(object):
+    """
+    The identifiers of a program interned as dense integer ids, in the order
+    they first appear. The parsers put the ids into the AST and the evaluators
+    index their environments with them; the names are only kept for printing.
+    """
+    __slots__ = ('names', 'ids')
+
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+
+    def intern(self, name):
+        sym = self.ids.get(name, -1)
+        if sym < 0:
+            sym = len(self.names)
+            self.names.append(name)
+            self.ids[name] = sym
+        return sym
+
+    def count(self):
+        return len(self.names)
+
+    def name(self, sym):
+        return self.names[sym]
+
+# Token sources the parsers read from. Tokens are addressed by their index
+# in the program and kind returns K_NONE past the last token.
+
+class TokenSource(object):
+    __slots__ = ('symbols',)  # SymbolTable of the identifiers
+
+    def kind(self, i):
+        raise Exception("TokenSource.kind not implemented")
+
+    def text(self, i):
+        # Spelling of a token with a string payload
+        raise Exception("TokenSource.text not implemented")
+
+    def number(self, i):
+        # Value of an integer or code of a character literal
+        raise Exception("TokenSource.number not implemented")
+
+    def symbol(self, i):
+        # Symbol id of an identifier or constant name
+        raise Exception("TokenSource.symbol not implemented")
+
+    def double(self, i):
+        return float(self.text(i))
+
+    def offset(self, i):
+        # Position of the token in the source
+        raise Exception("TokenSource.offset not implemented")
+
+    def release(self, i):
+        # The parser will not look at tokens before index i again
+        pass
+
+    def peek(self, i):
+        # Token i as a token object, for printing; the parsers do not use it
+        k = self.kind(i)
+        if k == K_NONE:
+            return None
+        elif k == K_SEMI:
+            return T_SEMI()
+        elif k == K_COLON:
+            return T_COLON()
+        elif k == K_COMMA:
+            return T_COMMA()
+        elif k == K_LPAREN:
+            return T_LPAREN()
+        elif k == K_RPAREN:
+            return T_RPAREN()
+        elif k == K_LBRACE:
+            return T_LBRACE()
+        elif k == K_RBRACE:
+            return T_RBRACE()
+        elif k == K_CHAR:
+            return T_CHAR(self.number(i))
+        elif k == K_INT:
+            return T_INT(self.number(i))
+        elif k == K_ID:
+            return T_ID(self.text(i))
+        elif k == K_TYPE:
+            return T_TYPE(self.text(i))
+        elif k == K_CONST:
+            return T_CONST(self.text(i))
+        elif k == K_STRING:
+            return T_STRING(self.text(i))
+        elif k == K_OP:
+            return T_OP(self.text(i))
+        elif k == K_DOUBLE:
+            return T_DOUBLE(self.double(i))
+        else:
+            return T_KWD(self.text(i))
+
+class TokenBuffer(TokenSource):
+    """
+    Struct-of-arrays token buffer: parallel lists of the kinds, payloads and
+    source offsets of the tokens, with their strings interned in a string
+    table. No token objects are allocated.
+    """
+    __slots__ = ('kinds', 'values', 'offsets', 'strings', 'string_ids')
+
+    def __init__(self, symbols):
+        self.symbols = symbols
+        self.kinds = []
+        self.values = []
+        self.offsets = []
+        self.strings = []
+        self.string_ids = {}
+
+    def length(self):
+        return len(self.kinds)
+
+    def intern_string(self, s):
+        idx = self.string_ids.get(s, -1)
+        if idx < 0:
+            idx = len(self.strings)
+            self.strings.append(s)
+            self.string_ids[s] = idx
+        return idx
+
+    def add(self, label, s, offset):
+        # Appends the token of a lexed (label, text) pair; whitespace and
+        # comments are skipped
+        k = token_kind(label)
+        if k == K_NONE:
+            return
+        if (OPTIONS.keywords == KEYWORDS_LOOKUP and k != K_KWD and
+                KEYWORD_TABLE.contains(s)):
+            k = K_KWD
+        if k == K_INT:
+            value = int(s)
+        elif k == K_CHAR:
+            # Special-case: the literal "'\\n'" is a newline
+            if s == "'\\n'":
+                value = 10
+            else:
+                value = ord(s[1])
+        elif k < K_CHAR:
+            value = 0
+        elif k >= K_ID:
+            value = self.symbols.intern(s)
+        else:
+            value = self.intern_string(s)
+        self.kinds.append(k)
+        self.values.append(value)
+        self.offsets.append(offset)
+
+    def kind(self, i):
+        if i < len(self.kinds):
+            return self.kinds[i]
+        return K_NONE
+
+    def text(self, i):
+        if self.kinds[i] >= K_ID:
+            return self.symbols.names[self.values[i]]
+        return self.strings[self.values[i]]
+
+    def number(self, i):
+        return self.values[i]
+
+    def symbol(self, i):
+        return self.values[i]
+
+    def offset(self, i):
+        return self.offsets[i]
+
+    def prefix(self, k):
+        # A buffer with the first k tokens that shares the string and
+        # symbol tables, which only grow, with this one
+        buf = TokenBuffer(self.symbols)
+        buf.strings = self.strings
+        buf.string_ids = self.string_ids
+        buf.kinds = self.kinds[:k]
+        buf.values = self.values[:k]
+        buf.offsets = self.offsets[:k]
+        return buf
+
+    def append_from(self, other, k, delta):
+        # Appends the tokens of other from index k on, moved by delta; the
+        # buffers share their tables
+        self.kinds += other.kinds[k:]
+        self.values += other.values[k:]
+        for j in range(k, len(other.offsets)):
+            self.offsets.append(other.offsets[j] + delta)
+
+    def drop(self, k):
+        # Removes the first k tokens. The string table is rebuilt from the
+        # remaining tokens, so that it does not keep the strings of the
+        # dropped ones
+        kinds = self.kinds[k:]
+        values = self.values[k:]
+        strings = self.strings
+        self.strings = []
+        self.string_ids = {}
+        for j in range(len(kinds)):
+            if kinds[j] >= K_TYPE and kinds[j] < K_ID:
+                values[j] = self.intern_string(strings[values[j]])
+        self.kinds = kinds
+        self.values = values
+        self.offsets = self.offsets[k:]
+
+def pack_tokens(pairs):
+    """Packs the lexed (label, text) pairs of a source into a TokenBuffer."""
+    buf = TokenBuffer(SymbolTable())
+    offset = 0
+    for pair in pairs:
+        label, s = pair
+        buf.add(label, s, offset)
+        offset += len(s)
+    return buf
+
+import os
+
+STREAM_CHUNK_SIZE = 65536
+
+class TokenStream(TokenSource):
+    """
+    Lexes the tokens of a file descriptor on demand, one token at a time with
+    maximal munch as in the munch mode. The input is read in chunks and only
+    the text from the start of the current token is kept, and released
+    tokens are dropped, so memory is bounded by the longest token and the
+    parser's lookahead rather than by the size of the file.
+    """
+    __slots__ = ('fd', 'r', 'classes', 'text_buf', 'start', 'pos', 'eof',
+                 'tokens', 'base', 'count', 'max_text', 'max_tokens')
+
+    def __init__(self, fd, r):
+        assert isinstance(r, STAR)
+        self.fd = fd
+        self.r = r.r
+        self.classes = partition_for(self.r)
+        self.text_buf = ""
+        self.start = 0  # offset of text_buf[0] in the source
+        self.pos = 0
+        self.eof = False
+        self.symbols = SymbolTable()
+        self.tokens = TokenBuffer(self.symbols)
+        self.base = 0  # index of the first buffered token in the program
+        self.count = 0
+        self.max_text = 0
+        self.max_tokens = 0
+
+    def index(self, i):
+        # Index of token i in the buffer, lexing up to it if needed, or -1
+        # past the last token
+        if i < self.base:
+            raise Exception("Token %d was already released" % i)
+        while i >= self.base + self.tokens.length():
+            if not self.lex_next():
+                return -1
+        return i - self.base
+
+    def kind(self, i):
+        j = self.index(i)
+        if j < 0:
+            return K_NONE
+        return self.tokens.kinds[j]
+
+    def text(self, i):
+        return self.tokens.text(self.index(i))
+
+    def number(self, i):
+        return self.tokens.number(self.index(i))
+
+    def symbol(self, i):
+        return self.tokens.symbol(self.index(i))
+
+    def offset(self, i):
+        return self.tokens.offset(self.index(i))
+
+    def release(self, i):
+        # The released prefix is dropped once it is half of the buffer, so
+        # that copying the rest stays linear overall
+        k = i - self.base
+        n = self.tokens.length()
+        if k > 0 and k <= n and 2 * k >= n:
+            self.tokens.drop(k)
+            self.base = i
+
+    def read_chunk(self):
+        data = os.read(self.fd, STREAM_CHUNK_SIZE)
+        if len(data) == 0:
+            self.eof = True
+            os.close(self.fd)
+        else:
+            self.start += self.pos
+            self.text_buf = self.text_buf[self.pos:] + data
+            self.pos = 0
+            if len(self.text_buf) > self.max_text:
+                self.max_text = len(self.text_buf)
+
+    def lex_next(self):
+        # Lexes the next token; returns False at the end of the input
+        while True:
+            if self.pos == len(self.text_buf):
+                if self.eof:
+                    return False
+                self.read_chunk()
+                continue
+            states = []
+            entries = []
+            end = munch_forward(self.r, self.classes, self.text_buf, self.pos, states, entries)
+            last = entries[len(entries) - 1].r
+            if (not self.eof and self.pos + len(entries) == len(self.text_buf) and
+                    not isinstance(last, ZERO)):
+                # the token may continue in the next chunk
+                self.read_chunk()
+                continue
+            if end < 0:
+                offset = dead_offset(self.r, self.classes, self.text_buf, self.pos)
+                self.pos = lex_error(self.text_buf, self.pos, offset, self.start)
+                continue
+            v = munch_value(self.text_buf, self.pos, end, states, entries)
+            n = self.tokens.length()
+            offset = self.start + self.pos
+            for pair in env(v):
+                label, s = pair
+                self.tokens.add(label, s, offset)
+                offset += len(s)
+            self.count += self.tokens.length() - n
+            if self.tokens.length() > self.max_tokens:
+                self.max_tokens = self.tokens.length()
+            self.pos = end
+            return True
+
+    def stats_string(self):
+        return "Token stream: %d tokens, at most %d buffered, at most %d characters buffered" % (
+            self.count, self.max_tokens, self.max_text)
+
+def open_token_stream(path):
+    fd = os.open(path, os.O_RDONLY, 0)
+    return TokenStream(fd, language_regex())
+
+def same_tokens(a, b):
+    """Whether two token buffers hold the same tokens at the same offsets."""
+    if a.length() != b.length():
+        return False
+    for i in range(a.length()):
+        k = a.kinds[i]
+        if k != b.kinds[i] or a.offsets[i] != b.offsets[i]:
+            return False
+        if k < K_TYPE:
+            if a.values[i] != b.values[i]:
+                return False
+        elif a.text(i) != b.text(i):
+            return False
+    return True
+
+class LexedSource(object):
+    """
+    A source lexed one token at a time with maximal munch, as in the munch
+    mode, keeping for every lexeme (whitespace and comments included) its
+    start, how far the lexer read to find it and how many tokens came
+    before it. relex uses them to lex again only the part of the source
+    that an edit can change.
+    """
+    __slots__ = ('r', 'classes', 'text', 'starts', 'reaches', 'counts',
+                 'tokens', 'relexed')
+
+    def __init__(self, r, classes, text, tokens):
+        self.r = r
+        self.classes = classes
+        self.text = text
+        self.starts = []
+        # end of the characters read for each lexeme; past the end of the
+        # text when the lexer stopped at the end of the input
+        self.reaches = []
+        self.counts = []
+        self.tokens = tokens
+        self.relexed = 0  # lexemes lexed to build this source
+
+    def relex(self, offset, removed, inserted):
+        """
+        The source after replacing the removed characters at offset with
+        the inserted text. Lexing restarts at the first lexeme whose
+        lexer read the edited text and stops once a lexeme starts where an
+        old lexeme started after the edit: maximal munch from there reads
+        the same text as before, so the old lexemes are reused from there
+        on, shifted by the change in length.
+        """
+        s = self.text[:offset] + inserted + self.text[offset + removed:]
+        delta = len(inserted) - removed
+        n = len(self.starts)
+        i = 0
+        while i < n and self.reaches[i] <= offset:
+            i += 1
+        if i < n:
+            pos = self.starts[i]
+            kept = self.counts[i]
+        else:
+            pos = len(self.text)
+            kept = self.tokens.length()
+        new = LexedSource(self.r, self.classes, s, self.tokens.prefix(kept))
+        new.starts = self.starts[:i]
+        new.reaches = self.reaches[:i]
+        new.counts = self.counts[:i]
+        edit_end = offset + len(inserted)
+        j = i
+        while pos < len(s):
+            if pos >= edit_end:
+                while j < n and self.starts[j] < pos - delta:
+                    j += 1
+                if j < n and self.starts[j] == pos - delta:
+                    new.append_lexemes(self, j, delta)
+                    break
+            states = []
+            entries = []
+            end = munch_forward(self.r, self.classes, s, pos, states, entries)
+            if end < 0:
+                raise LexError(dead_offset(self.r, self.classes, s, pos))
+            reach = pos + len(entries)
+            if not isinstance(entries[len(entries) - 1].r, ZERO):
+                reach = len(s) + 1
+            new.starts.append(pos)
+            new.reaches.append(reach)
+            new.counts.append(new.tokens.length())
+            v = munch_value(s, pos, end, states, entries)
+            for pair in env(v):
+                label, t = pair
+                new.tokens.add(label, t, pos)
+                pos += len(t)
+            new.relexed += 1
+        return new
+
+    def append_lexemes(self, old, j, delta):
+        # Reuses the lexemes of old from index j on, moved by delta
+        first = old.counts[j]
+        base = self.tokens.length()
+        for k in range(j, len(old.starts)):
+            self.starts.append(old.starts[k] + delta)
+            self.reaches.append(old.reaches[k] + delta)
+            self.counts.append(old.counts[k] - first + base)
+        self.tokens.append_from(old.tokens, first, delta)
+
+def lex_source(s):
+    """Lexes s as a LexedSource that can be re-lexed after edits."""
+    r = language_regex()
+    assert isinstance(r, STAR)
+    classes = partition_for(r.r)
+    empty = LexedSource(r.r, classes, "", TokenBuffer(SymbolTable()))
+    return empty.relex(0, 0, s)
 
 # Main Lexer Function
 
@@ -934,21 +3176,30 @@ import time
 # For RPython since it does not call the __repr__ method by default
 def print_tokens(tokens):
     s = "["
-    first = True
-    for token in tokens:
-        if not first:
+    for i in range(tokens.length()):
+        if i > 0:
             s += ", "
-        else:
-            first = False
-        s += token.__repr__()
+        s += tokens.peek(i).__repr__()
     s += "]"
     return s
 
 def lex(contents):
     print("Lex:")
+    DERIV_CACHE.reset_stats()
+    SIZE_TRACE.reset()
+    COUNTERS.reset()
+    LEX_ERRORS.reset()
     start = time.time()
     tokens = tokenise(contents)
     end = time.time()
     print(print_tokens(tokens))
     print("Lexing Time taken: " + str(end - start) + " seconds")
+    print(DERIV_CACHE.stats_string())
+    if SIZE_TRACE.enabled:
+        print(SIZE_TRACE.steps_string())
+        print(SIZE_TRACE.stats_string())
+    if COUNTERS_BUILT and COUNTERS.enabled:
+        print(COUNTERS.report_string())
+    if LEX_ERRORS.count() > 0:
+        print(LEX_ERRORS.report_string())
     return tokens
\ No newline at end of file
@@ -1,7 +1,7 @@
 from lexer import (
-    T_SEMI, T_COLON, T_COMMA, T_LPAREN, T_RPAREN,
-    T_LBRACE, T_RBRACE, T_ID, T_TYPE, T_CONST, T_CHAR,
-    T_STRING, T_OP, T_INT, T_DOUBLE, T_KWD
+    K_NONE, K_SEMI, K_COLON, K_COMMA, K_LPAREN, K_RPAREN,
+    K_LBRACE, K_RBRACE, K_ID, K_TYPE, K_CONST, K_CHAR,
+    K_STRING, K_OP, K_INT, K_DOUBLE, K_KWD
 )
     
 # AST Definitions
@@ -10,13 +10,15 @@ class Decl(object):
     __slots__ = ()
 
 class Def(Decl):
-    __slots__ = ('name', 'args', 'ty', 'body')
+    __slots__ = ('name', 'args', 'ty', 'body', 'sym', 'arg_syms')
 
-    def __init__(self, name, args, ty, body):
+    def __init__(self, name, args, ty, body, sym, arg_syms):
         self.name = name         
         self.args = args         
         self.ty = ty              
         self.body = body          
+        self.sym = sym            # symbol id of name
+        self.arg_syms = arg_syms  # symbol ids of the parameters
     def __repr__(self):
         return "Def(%s, %s, %s, %s)" % (self.name, self.args, self.ty, self.body.__repr__())
 
@@ -30,21 +32,23 @@ class Main(Decl):
         return "Main(%s)" % (self.body.__repr__())
 
 class Const(Decl):
-    __slots__ = ('name', 'value')
+    __slots__ = ('name', 'value', 'sym')
 
-    def __init__(self, name, value):
+    def __init__(self, name, value, sym):
         self.name = name
         self.value = value
+        self.sym = sym
 
     def __repr__(self):
         return "Const(%s, %d)" % (self.name, self.value)
 
 class FConst(Decl):
-    __slots__ = ('name', 'value')
+    __slots__ = ('name', 'value', 'sym')
 
-    def __init__(self, name, value):
+    def __init__(self, name, value, sym):
         self.name = name
         self.value = value
+        self.sym = sym
 
     def __repr__(self):
         return "FConst(%s, %f)" % (self.name, self.value)
@@ -59,10 +63,11 @@ class BExp(object):
     __slots__ = ()
 
 class Var(Exp):
-    __slots__ = ('s',)
+    __slots__ = ('s', 'sym')
 
-    def __init__(self, s):
+    def __init__(self, s, sym):
         self.s = s
+        self.sym = sym
 
     def __repr__(self):
         return "Var(%s)" % self.s
@@ -125,11 +130,12 @@ class PrintString(Exp):
         return 'PrintString("%s")' % self.s
 
 class Call(Exp):
-    __slots__ = ('name', 'args')
+    __slots__ = ('name', 'args', 'sym')
 
-    def __init__(self, name, args):
+    def __init__(self, name, args, sym):
         self.name = name  
         self.args = args  
+        self.sym = sym    
 
     def __repr__(self):
         args_str = ", ".join([arg.__repr__() for arg in self.args])
@@ -158,28 +164,26 @@ class Bop(BExp):
         return "Bop(" + self.op + ", " + self.left.__repr__() + ", " + self.right.__repr__() + ")"
 
 
-# Peek and Error Helpers
+# Token and Error Helpers
+
+def is_kwd(tks, i, kw):
+    """Whether token i is the keyword kw."""
+    return tks.kind(i) == K_KWD and tks.text(i) == kw
 
-def peek_token(tks, i):
-    """Return tks[i] if i in range, else None."""
-    if i < len(tks):
-        return tks[i]
-    return None
+class ParseError(Exception):
+    __slots__ = ()
 
 def error_expected(msg, i):
-    raise Exception("Parse error at token index %d: expected %s" % (i, msg))
+    raise ParseError("Parse error at token index %d: expected %s" % (i, msg))
 
 
 # Parsing Block: block := '{' Exp '}' | Exp
 
 def parse_Block(tks, i):
-    t = peek_token(tks, i)
-
-    if t is not None and isinstance(t, T_LBRACE):
+    if tks.kind(i) == K_LBRACE:
         i2 = i + 1
         exp_node, i3 = parse_Exp(tks, i2)
-        t2 = peek_token(tks, i3)
-        if t2 is None or not isinstance(t2, T_RBRACE):
+        if tks.kind(i3) != K_RBRACE:
             error_expected("'}'", i3)
         return exp_node, i3 + 1
     
@@ -192,13 +196,10 @@ def parse_Block(tks, i):
 # block_no_seq := '{' Exp '}' | Exp_no_seq
 
 def parse_Block_no_seq(tks, i):
-    t = peek_token(tks, i)
-
-    if t is not None and isinstance(t, T_LBRACE):
+    if tks.kind(i) == K_LBRACE:
         i2 = i + 1
         exp_node, i3 = parse_Exp(tks, i2)  # inside braces, sequences are allowed
-        t2 = peek_token(tks, i3)
-        if t2 is None or not isinstance(t2, T_RBRACE):
+        if tks.kind(i3) != K_RBRACE:
             error_expected("'}'", i3)
         return exp_node, i3 + 1
     
@@ -209,18 +210,14 @@ def parse_Block_no_seq(tks, i):
 
 def parse_Exp_no_seq(tks, i):
     # Try "if" BExp "then" Block_no_seq "else" Block_no_seq
-    t = peek_token(tks, i)
-
-    if t and isinstance(t, T_KWD) and t.s == "if":
+    if is_kwd(tks, i, "if"):
         i2 = i + 1
         cond_node, i3 = parse_BExp(tks, i2)
-        then_t = peek_token(tks, i3)
-        if not (then_t and isinstance(then_t, T_KWD) and then_t.s == "then"):
+        if not is_kwd(tks, i3, "then"):
             error_expected("'then'", i3)
         i4 = i3 + 1
         then_blk, i5 = parse_Block_no_seq(tks, i4)
-        else_t = peek_token(tks, i5)
-        if not (else_t and isinstance(else_t, T_KWD) and else_t.s == "else"):
+        if not is_kwd(tks, i5, "else"):
             error_expected("'else'", i5)
         i6 = i5 + 1
         else_blk, i7 = parse_Block_no_seq(tks, i6)
@@ -235,12 +232,11 @@ def parse_Exp_no_seq(tks, i):
 
 def parse_BExp(tks, i):
     left_node, i2 = parse_Exp(tks, i)
-    op_t = peek_token(tks, i2)
 
-    if op_t and isinstance(op_t, T_OP) and op_t.s in ["==","!=","<",">","<=",">="]:
+    if tks.kind(i2) == K_OP and tks.text(i2) in ["==","!=","<",">","<=",">="]:
         i3 = i2 + 1
         right_node, i4 = parse_Exp(tks, i3)
-        return Bop(op_t.s, left_node, right_node), i4
+        return Bop(tks.text(i2), left_node, right_node), i4
     
     error_expected("a boolean operator (==, !=, <, >, <=, >=)", i2)
     return None, i2
@@ -265,18 +261,14 @@ def try_parse_in_expr(tks, i):
 
 def parse_Exp(tks, i):
     # Try "if" BExp "then" Block "else" Block
-    t = peek_token(tks, i)
-
-    if t and isinstance(t, T_KWD) and t.s == "if":
+    if is_kwd(tks, i, "if"):
         i2 = i + 1
         cond_node, i3 = parse_BExp(tks, i2)
-        then_t = peek_token(tks, i3)
-        if not (then_t and isinstance(then_t, T_KWD) and then_t.s == "then"):
+        if not is_kwd(tks, i3, "then"):
             error_expected("'then'", i3)
         i4 = i3 + 1
         then_blk, i5 = parse_Block(tks, i4)
-        else_t = peek_token(tks, i5)
-        if not (else_t and isinstance(else_t, T_KWD) and else_t.s == "else"):
+        if not is_kwd(tks, i5, "else"):
             error_expected("'else'", i5)
         i6 = i5 + 1
         else_blk, i7 = parse_Block(tks, i6)
@@ -284,8 +276,7 @@ def parse_Exp(tks, i):
 
     # Otherwise, parse M
     m_node, i_m = parse_M(tks, i)
-    sem_t = peek_token(tks, i_m)
-    if sem_t and isinstance(sem_t, T_SEMI):
+    if tks.kind(i_m) == K_SEMI:
         # Attempt to parse an expression after the semicolon as an in-expression.
         success, next_expr, new_i = try_parse_in_expr(tks, i_m + 1)
         if success:
@@ -302,23 +293,18 @@ def parse_Exp(tks, i):
 # M := "print_string" "(" StringParser ")" | L
 
 def parse_M(tks, i):
-    t = peek_token(tks, i)
-
-    if t and isinstance(t, T_ID) and t.s == "print_string":
+    if tks.kind(i) == K_ID and tks.text(i) == "print_string":
         i2 = i + 1
-        lp = peek_token(tks, i2)
-        if not (lp and isinstance(lp, T_LPAREN)):
+        if tks.kind(i2) != K_LPAREN:
             error_expected("'(' after print_string", i2)
         i3 = i2 + 1
-        s_token = peek_token(tks, i3)
-        if not (s_token and isinstance(s_token, T_STRING)):
+        if tks.kind(i3) != K_STRING:
             error_expected("string-literal", i3)
         i4 = i3 + 1
-        rp = peek_token(tks, i4)
-        if not (rp and isinstance(rp, T_RPAREN)):
+        if tks.kind(i4) != K_RPAREN:
             error_expected("')' after string", i4)
         i5 = i4 + 1
-        return PrintString(s_token.s), i5
+        return PrintString(tks.text(i3)), i5
     
     return parse_L(tks, i)
 
@@ -327,12 +313,11 @@ def parse_M(tks, i):
 
 def parse_L(tks, i):
     left_node, i2 = parse_T(tks, i)
-    op_t = peek_token(tks, i2)
 
-    if op_t and isinstance(op_t, T_OP) and op_t.s in ["+","-"]:
+    if tks.kind(i2) == K_OP and tks.text(i2) in ["+","-"]:
         i3 = i2 + 1
         right_node, i4 = parse_Exp(tks, i3)
-        return Aop(op_t.s, left_node, right_node), i4
+        return Aop(tks.text(i2), left_node, right_node), i4
     
     return left_node, i2
 
@@ -341,12 +326,11 @@ def parse_L(tks, i):
 
 def parse_T(tks, i):
     left_node, i2 = parse_F(tks, i)
-    op_t = peek_token(tks, i2)
 
-    if op_t and isinstance(op_t, T_OP) and op_t.s in ["*","/","%"]:
+    if tks.kind(i2) == K_OP and tks.text(i2) in ["*","/","%"]:
         i3 = i2 + 1
         right_node, i4 = parse_T(tks, i3)
-        return Aop(op_t.s, left_node, right_node), i4
+        return Aop(tks.text(i2), left_node, right_node), i4
     return left_node, i2
 
 
@@ -354,50 +338,47 @@ def parse_T(tks, i):
 #       | Id | Int | Double | Char
 
 def parse_F(tks, i):
-    t = peek_token(tks, i)
+    k = tks.kind(i)
 
-    if t and isinstance(t, T_ID):
-        func_name = t.s
+    if k == K_ID:
+        func_name = tks.text(i)
+        sym = tks.symbol(i)
         i2 = i + 1
-        maybe_lp = peek_token(tks, i2)
-        if maybe_lp and isinstance(maybe_lp, T_LPAREN):
+        if tks.kind(i2) == K_LPAREN:
             i3 = i2 + 1
-            maybe_rp = peek_token(tks, i3)
-            if maybe_rp and isinstance(maybe_rp, T_RPAREN):
-                return Call(func_name, []), i3 + 1
+            if tks.kind(i3) == K_RPAREN:
+                return Call(func_name, [], sym), i3 + 1
             else:
                 args, i_after_args = parse_ArgList(tks, i3)
-                closep = peek_token(tks, i_after_args)
-                if not (closep and isinstance(closep, T_RPAREN)):
+                if tks.kind(i_after_args) != K_RPAREN:
                     error_expected("')'", i_after_args)
-                return Call(func_name, args), i_after_args + 1
+                return Call(func_name, args, sym), i_after_args + 1
         else:
             if func_name == "skip":
-                return Call("skip", []), i2
-            return Var(func_name), i2
+                return Call("skip", [], sym), i2
+            return Var(func_name, sym), i2
         
-    elif t and isinstance(t, T_CONST):
-        const_name = t.s
-        return Var(const_name), i + 1
+    elif k == K_CONST:
+        const_name = tks.text(i)
+        return Var(const_name, tks.symbol(i)), i + 1
     
-    elif t and isinstance(t, T_LPAREN):
+    elif k == K_LPAREN:
         i2 = i + 1
         subexp, i3 = parse_Exp(tks, i2)
-        rp = peek_token(tks, i3)
-        if not (rp and isinstance(rp, T_RPAREN)):
+        if tks.kind(i3) != K_RPAREN:
             error_expected("')'", i3)
         return subexp, i3 + 1
     
-    elif t and isinstance(t, T_INT):
-        node = Num(t.n)
+    elif k == K_INT:
+        node = Num(tks.number(i))
         return node, i + 1
     
-    elif t and isinstance(t, T_DOUBLE):
-        node = FNum(t.n)
+    elif k == K_DOUBLE:
+        node = FNum(tks.double(i))
         return node, i + 1
     
-    elif t and isinstance(t, T_CHAR):
-        node = ChConst(t.c)
+    elif k == K_CHAR:
+        node = ChConst(tks.number(i))
         return node, i + 1
     
     error_expected("a factor (identifier, literal, '('Exp')', etc.)", i)
@@ -410,14 +391,10 @@ def parse_ArgList(tks, i):
     first_node, i2 = parse_Exp(tks, i)
     args = [first_node]
 
-    while True:
-        t = peek_token(tks, i2)
-        if t and isinstance(t, T_COMMA):
-            i2 += 1
-            next_exp, i2 = parse_Exp(tks, i2)
-            args.append(next_exp)
-        else:
-            break
+    while tks.kind(i2) == K_COMMA:
+        i2 += 1
+        next_exp, i2 = parse_Exp(tks, i2)
+        args.append(next_exp)
 
     return args, i2
 
@@ -426,136 +403,130 @@ def parse_ArgList(tks, i):
 
 def parse_ParamList(tks, i):
     params = []
-    first_id, i2 = parse_IdTypePair(tks, i)
+    syms = []
+    first_id, first_sym, i2 = parse_IdTypePair(tks, i)
     params.append(first_id)
+    syms.append(first_sym)
 
-    while True:
-        t = peek_token(tks, i2)
-        if t and isinstance(t, T_COMMA):
-            i2 += 1
-            next_pair, i2 = parse_IdTypePair(tks, i2)
-            params.append(next_pair)
-        else:
-            break
+    while tks.kind(i2) == K_COMMA:
+        i2 += 1
+        next_pair, next_sym, i2 = parse_IdTypePair(tks, i2)
+        params.append(next_pair)
+        syms.append(next_sym)
 
-    return params, i2
+    return params, syms, i2
 
 def parse_IdTypePair(tks, i):
-    t_id = peek_token(tks, i)
-
-    if not (t_id and isinstance(t_id, T_ID)):
+    if tks.kind(i) != K_ID:
         error_expected("identifier in parameter list", i)
 
     i2 = i + 1
-    c = peek_token(tks, i2)
 
-    if not (c and isinstance(c, T_COLON)):
+    if tks.kind(i2) != K_COLON:
         error_expected("':' in parameter list", i2)
 
     i3 = i2 + 1
-    ty_t = peek_token(tks, i3)
 
-    if not (ty_t and isinstance(ty_t, T_TYPE)):
+    if tks.kind(i3) != K_TYPE:
         error_expected("type in parameter list", i3)
 
-    return (t_id.s, ty_t.s), i3 + 1
+    return (tks.text(i), tks.text(i3)), tks.symbol(i), i3 + 1
 
 
 # Parsing Definitions: Defn := def ... or val ...
 
 def parse_Defn(tks, i):
-    kw = peek_token(tks, i)
-    if not (kw and isinstance(kw, T_KWD) and kw.s in ["def","val"]):
+    if tks.kind(i) != K_KWD:
+        return False, i, None
+    kw = tks.text(i)
+    if kw != "def" and kw != "val":
         return False, i, None
     
-    if kw.s == "def":
+    if kw == "def":
         i2 = i + 1
-        name_t = peek_token(tks, i2)
-        if not (name_t and isinstance(name_t, T_ID)):
+        if tks.kind(i2) != K_ID:
             error_expected("identifier after 'def'", i2)
-        func_name = name_t.s
+        func_name = tks.text(i2)
+        func_sym = tks.symbol(i2)
         i3 = i2 + 1
-        lp = peek_token(tks, i3)
-        if not (lp and isinstance(lp, T_LPAREN)):
+        if tks.kind(i3) != K_LPAREN:
             error_expected("'(' after def name", i3)
         i4 = i3 + 1
-        rp = peek_token(tks, i4)
         params = []
+        param_syms = []
         i5 = i4
-        if rp and isinstance(rp, T_RPAREN):
+        if tks.kind(i4) == K_RPAREN:
             i6 = i4 + 1
         else:
-            params, i5 = parse_ParamList(tks, i4)
-            rp = peek_token(tks, i5)
-            if not (rp and isinstance(rp, T_RPAREN)):
+            params, param_syms, i5 = parse_ParamList(tks, i4)
+            if tks.kind(i5) != K_RPAREN:
                 error_expected("')' after parameter list", i5)
             i6 = i5 + 1
-        c = peek_token(tks, i6)
-        if not (c and isinstance(c, T_COLON)):
+        if tks.kind(i6) != K_COLON:
             error_expected("':' after param list", i6)
         i7 = i6 + 1
-        ty_t = peek_token(tks, i7)
-        if not (ty_t and isinstance(ty_t, T_TYPE)):
+        if tks.kind(i7) != K_TYPE:
             error_expected("return type", i7)
+        ty = tks.text(i7)
         i8 = i7 + 1
-        eq_t = peek_token(tks, i8)
-        if not (eq_t and isinstance(eq_t, T_OP) and eq_t.s == "="):
+        if not (tks.kind(i8) == K_OP and tks.text(i8) == "="):
             error_expected("'=' after return type", i8)
         i9 = i8 + 1
         # Use the new parse_Block_no_seq here so that the trailing semicolon is not consumed.
         body_node, i10 = parse_Block_no_seq(tks, i9)
-        return True, i10, Def(func_name, params, ty_t.s, body_node)
+        return True, i10, Def(func_name, params, ty, body_node, func_sym, param_syms)
     
     else:
         # "val" case
         i2 = i + 1
-        cst = peek_token(tks, i2)
-        if not (cst and isinstance(cst, T_CONST)):
+        if tks.kind(i2) != K_CONST:
             error_expected("constant name after 'val'", i2)
-        name = cst.s
+        name = tks.text(i2)
+        sym = tks.symbol(i2)
         i3 = i2 + 1
-        col = peek_token(tks, i3)
-        if not (col and isinstance(col, T_COLON)):
+        if tks.kind(i3) != K_COLON:
             error_expected("':' after constant name", i3)
         i4 = i3 + 1
-        type_t = peek_token(tks, i4)
-        if not (type_t and isinstance(type_t, T_TYPE) and type_t.s in ["Int","Double"]):
+        if not (tks.kind(i4) == K_TYPE and tks.text(i4) in ["Int","Double"]):
             error_expected("type 'Int' or 'Double'", i4)
+        ty = tks.text(i4)
         i5 = i4 + 1
-        eq_t = peek_token(tks, i5)
-        if not (eq_t and isinstance(eq_t, T_OP) and eq_t.s == "="):
+        if not (tks.kind(i5) == K_OP and tks.text(i5) == "="):
             error_expected("'=' after val's type", i5)
         i6 = i5 + 1
-        lit = peek_token(tks, i6)
-        if not lit:
+        lit = tks.kind(i6)
+        if lit == K_NONE:
             error_expected("an integer or double literal", i6)
-        if type_t.s == "Int":
-            if not isinstance(lit, T_INT):
+        if ty == "Int":
+            if lit != K_INT:
                 error_expected("integer literal", i6)
-            node = Const(name, lit.n)
+            node = Const(name, tks.number(i6), sym)
             return True, i6 + 1, node
         else:
-            if not isinstance(lit, T_DOUBLE):
+            if lit != K_DOUBLE:
                 error_expected("double literal", i6)
-            node = FConst(name, lit.n)
+            node = FConst(name, tks.double(i6), sym)
             return True, i6 + 1, node
 
 
 # Parsing Programs: Prog := (Defn ";" Prog) | (Block mapped to Main)
 
 def parse_Prog(tks, i):
-    has_defn, i2, defn_node = parse_Defn(tks, i)
-    if has_defn:
+    prog = []
+    while True:
+        has_defn, i2, defn_node = parse_Defn(tks, i)
+        if not has_defn:
+            break
         # Expect a semicolon after a definition (top-level semicolon)
-        sm = peek_token(tks, i2)
-        if not (sm and isinstance(sm, T_SEMI)):
+        if tks.kind(i2) != K_SEMI:
             error_expected("';' after declaration", i2)
-        i3 = i2 + 1
-        rest, i4 = parse_Prog(tks, i3)
-        return [defn_node] + rest, i4
-    else:
-        block_node, iB = parse_Block(tks, i)
-        return [Main(block_node)], iB
+        prog.append(defn_node)
+        i = i2 + 1
+        # the parser never goes back into a finished definition
+        tks.release(i)
+    block_node, iB = parse_Block(tks, i)
+    prog.append(Main(block_node))
+    return prog, iB
 
 # Top-level parse function
 
@@ -577,8 +548,8 @@ def parse(tks):
     start = time.time()
     ast, i2 = parse_Prog(tks, 0)
     end = time.time()
-    if i2 != len(tks):
-        raise Exception("Extra tokens after program at index %d" % i2)
+    if tks.kind(i2) != K_NONE:
+        raise ParseError("Extra tokens after program at index %d" % i2)
     print("AST:")
     print(print_ast(ast))
     print("Parse Time: " + str(end - start) + "s")
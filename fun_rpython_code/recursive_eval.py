@@ -60,6 +60,9 @@ class NoneValue(Value):
     __slots__ = ()
 
 
+# Environments are lists of Values indexed by the symbol ids of the program,
+# with None for names that are not bound.
+
 # We store functions in the environment as one of these classes below:
 
 
@@ -137,7 +140,7 @@ class ClosureFunction(FuncValue):
     __slots__ = ('params', 'body', 'env')
 
     def __init__(self, params, body, env):
-        # params is a list of (name, type) pairs
+        # params is the list of the symbol ids of the parameters
         self.params = params
         self.body = body
         self.env = env
@@ -150,12 +153,11 @@ class ClosureFunction(FuncValue):
                 % (len(self.params), len(arg_vals))
             )
         # Create a new environment for the function call
-        new_env = self.env.copy()
+        new_env = self.env[:]
         idx = 0
 
         while idx < len(self.params):
-            param_name, _ = self.params[idx]
-            new_env[param_name] = arg_vals[idx]
+            new_env[self.params[idx]] = arg_vals[idx]
             idx += 1
 
         # Evaluate body
@@ -181,9 +183,10 @@ def eval_exp(exp, env):
         return IntValue(exp.c)
 
     elif isinstance(exp, Var):
-        if exp.s not in env:
+        val = env[exp.sym]
+        if val is None:
             raise Exception("Undefined variable: " + exp.s)
-        return env[exp.s]
+        return val
 
     elif isinstance(exp, Aop):
         left_val = eval_exp(exp.a1, env)
@@ -245,9 +248,9 @@ def eval_exp(exp, env):
             arg_vals.append(eval_exp(exp.args[i], env))
             i += 1
         # Now call the function
-        if exp.name not in env:
+        func_val = env[exp.sym]
+        if func_val is None:
             raise Exception("Undefined function: " + exp.name)
-        func_val = env[exp.name]
         if not isinstance(func_val, FuncValue):
             raise Exception(exp.name + " is not a function")
         return func_val.call(arg_vals)
@@ -306,20 +309,20 @@ def eval_decl(decl, env):
     """
 
     if isinstance(decl, Const):
-        env[decl.name] = IntValue(decl.value)
+        env[decl.sym] = IntValue(decl.value)
         return NoneValue()
 
     elif isinstance(decl, FConst):
-        env[decl.name] = FloatValue(decl.value)
+        env[decl.sym] = FloatValue(decl.value)
         return NoneValue()
 
     elif isinstance(decl, Def):
         # Insert a placeholder first for recursion
-        env[decl.name] = NoneValue()
+        env[decl.sym] = NoneValue()
 
         # Create a closure object for this user-defined function
-        closure = ClosureFunction(decl.args, decl.body, env)
-        env[decl.name] = closure
+        closure = ClosureFunction(decl.arg_syms, decl.body, env)
+        env[decl.sym] = closure
         return NoneValue()
 
     elif isinstance(decl, Main):
@@ -330,20 +333,23 @@ def eval_decl(decl, env):
 
 # Interpret a FUN program (list of declarations)
 
-def interpret_program(decls):
+BUILTINS = ['skip', 'print_int', 'print_char', 'print_space', 'print_star', 'new_line']
+
+def interpret_program(decls, symbols):
     """
     Interpret a FUN program (list of declarations).
     Returns the last non-NoneValue result.
     """
+    # The built-in names get symbol ids as well, also when the program
+    # does not mention them
+    builtin_syms = [symbols.intern(name) for name in BUILTINS]
+
     # Start with an environment containing built-in functions
-    env = {
-        'skip':        BuiltinFunction('skip'),
-        'print_int':   BuiltinFunction('print_int'),
-        'print_char':  BuiltinFunction('print_char'),
-        'print_space': BuiltinFunction('print_space'),
-        'print_star':  BuiltinFunction('print_star'),
-        'new_line':    BuiltinFunction('new_line'),
-    }
+    env = [None] * symbols.count()
+    i = 0
+    while i < len(BUILTINS):
+        env[builtin_syms[i]] = BuiltinFunction(BUILTINS[i])
+        i += 1
 
     result = NoneValue()
     i = 0
@@ -357,13 +363,13 @@ def interpret_program(decls):
 
 #######################################################################
 
-def run(ast):
+def run(ast, symbols):
     """
     Entry point to run a FUN program.
     Evaluate the AST, print the result if it's an IntValue or StrValue.
     """
     start = time.time()
-    result = interpret_program(ast)
+    result = interpret_program(ast, symbols)
     end = time.time()
 
     # Print result if it's IntValue or StrValue
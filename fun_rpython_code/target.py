@@ -1,34 +1,90 @@
 import sys
 import os
 
-from lexer import lex
-from parser import parse
+from lexer import (lex, set_lexing_mode, set_simp_mode, set_keyword_mode,
+                   enable_size_trace, enable_recovery, LexError, LEX_ERRORS,
+                   enable_counters, build_counters, open_token_stream)
+#from dfa_lexer import lex
+from parser import parse, ParseError
 from recursive_eval import run
 
-def read_file(file):
+def source_path(file):
     cwd = os.getcwd()
-    path = os.path.join(os.path.join(cwd, "fun_examples"), file)
+    return os.path.join(os.path.join(cwd, "fun_examples"), file)
+
+def read_file(file):
+    path = source_path(file)
     f = open(path, "r")
     content = f.read()
     f.close()
     return content
 
 def target(driver, args):
+    # The hot-path counters are only built into the executable when
+    # LEXER_COUNTERS=1 is set while translating
+    build_counters(os.environ.get("LEXER_COUNTERS", "") == "1")
     return main, None
 
 def main(argv=None):
     if argv is None:
         argv = []
 
-    if len(argv) < 2:
-        print("Usage: %s <filename>" % (argv[0] if argv else "program"))
+    # Lexer options such as --lexer=bits may appear anywhere on the command line
+    stream = False
+    args = []
+    for arg in argv:
+        if arg.startswith("--lexer="):
+            set_lexing_mode(arg[len("--lexer="):])
+        elif arg.startswith("--simp="):
+            set_simp_mode(arg[len("--simp="):])
+        elif arg.startswith("--keywords="):
+            set_keyword_mode(arg[len("--keywords="):])
+        elif arg == "--trace-sizes":
+            enable_size_trace()
+        elif arg == "--count-calls":
+            enable_counters()
+        elif arg == "--stream":
+            stream = True
+        elif arg == "--recover":
+            enable_recovery()
+        else:
+            args.append(arg)
+
+    if len(args) < 2:
+        print("Usage: %s [--lexer=simp|bits|munch|recognise|antimirov] [--simp=basic|aci] [--keywords=regex|lookup] [--trace-sizes] [--count-calls] [--recover] [--stream] <filename>" % (argv[0] if argv else "program"))
         return 1
 
-    filename = argv[1]
-    contents = read_file(filename)
-    tokens = lex(contents)
-    ast = parse(tokens)
-    run(ast)
+    filename = args[1]
+    try:
+        if stream:
+            # lex on demand while parsing, without reading the whole file first
+            source = open_token_stream(source_path(filename))
+            try:
+                ast = parse(source)
+            except ParseError:
+                # the text skipped by --recover leaves gaps in the tokens;
+                # the lexing errors are reported instead of what they break
+                if LEX_ERRORS.count() > 0:
+                    print(LEX_ERRORS.report_string())
+                    return 1
+                raise
+            if LEX_ERRORS.count() > 0:
+                print(LEX_ERRORS.report_string())
+                return 1
+            print(source.stats_string())
+            symbols = source.symbols
+        else:
+            contents = read_file(filename)
+            tokens = lex(contents)
+            if LEX_ERRORS.count() > 0:
+                # lex has printed the errors
+                return 1
+            symbols = tokens.symbols
+            ast = parse(tokens)
+    except LexError as e:
+        print(e.describe())
+        return 1
+    run(ast, symbols)
     return 0
 
 if __name__ == "__main__":
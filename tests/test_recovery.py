@@ -0,0 +1,62 @@
+"""
+Lexing error recovery through the interpreters' command line.
+
+Runs the Python2 WHILE interpreter and the FUN interpreter with --stream
+and --recover on a program with an illegal character, which the parser
+then sees as a gap in the tokens. The interpreter has to report the
+lexing error instead of failing on the parse error it causes.
+
+Run from the repository root with Python2:
+    python2 -m unittest discover tests
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def run_target(directory, examples, name, text, args):
+    # The targets read their programs from <cwd>/<examples>
+    tmp = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(tmp, examples))
+        f = open(os.path.join(tmp, examples, name), "w")
+        f.write(text)
+        f.close()
+        target = os.path.join(ROOT, directory, "target.py")
+        child = subprocess.Popen([sys.executable, target] + args + [name],
+                                 cwd=tmp, stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT)
+        out = child.communicate()[0]
+        return child.returncode, out.decode("ascii", "replace")
+    finally:
+        shutil.rmtree(tmp)
+
+
+@unittest.skipIf(sys.version_info[0] != 2, "the interpreters are Python2 programs")
+class StreamRecoveryTest(unittest.TestCase):
+
+    def check_reported(self, status, out, offset):
+        self.assertEqual(status, 0, out)
+        self.assertNotIn("Traceback", out)
+        self.assertIn("lexing error at offset %d: skipped \"$\"" % offset, out)
+
+    def test_while_stream_recover(self):
+        status, out = run_target("while_python2_code", "examples", "bad.while",
+                                 "x := 1;\ny := 2 $ 3;\nwrite x\n",
+                                 ["--stream", "--recover"])
+        self.check_reported(status, out, 15)
+
+    def test_fun_stream_recover(self):
+        status, out = run_target("fun_rpython_code", "fun_examples", "bad.fun",
+                                 "def inc(n: Int) : Int = n + 1 $ 0;\n\nprint_int(inc(3))\n",
+                                 ["--stream", "--recover"])
+        self.check_reported(status, out, 30)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,411 @@
+"""
+Lazy derivative-DFA tokenizer for the WHILE language.
+
+DFA states are interned derivatives of the token records in LANGUAGE_REGEX.
+The RECD labels are kept in the derivatives, so an accepting state knows
+which record wins without injecting values. States and transitions are
+built on demand and cached in a table indexed by (state, character class),
+using the alphabet partition of the token regex; once the table is warm,
+tokenising is a table walk plus accepting-state lookups.
+
+Running this module as a script explores the whole DFA ahead of time,
+minimises it and writes it next to the sources (see TABLE_PATH). lex()
+loads that table with a single read on first use and falls back to the
+lazy DFA when the table is missing or was built from different regexes.
+"""
+
+from lexer import (ZERO, ONE, CHAR, ALT, SEQ, STAR, RANGE, PLUS, OPTIONAL,
+                   NTIMES, RECD, CharClasses, mk_zero, mk_alt, mk_seq, mk_recd, der,
+                   nullable, partition_for, pack_tokens, LEX_ERRORS,
+                   lex_error, ERROR_LABEL, LANGUAGE_REGEX)
+
+import os
+import time
+
+# Simplification without rectification functions, the DFA only needs the
+# regex. Nested alternatives are flattened and duplicates removed wherever
+# they occur, which keeps the number of DFA states finite.
+def simp_rexp(r):
+    if isinstance(r, ALT):
+        alts = []
+        flatten_alts(r, alts, {})
+        if len(alts) == 0:
+            return mk_zero()
+        result = alts[len(alts) - 1]
+        i = len(alts) - 2
+        while i >= 0:
+            result = mk_alt(alts[i], result)
+            i -= 1
+        return result
+    elif isinstance(r, SEQ):
+        r1s = simp_rexp(r.r1)
+        r2s = simp_rexp(r.r2)
+        if isinstance(r1s, ZERO) or isinstance(r2s, ZERO):
+            return mk_zero()
+        elif isinstance(r1s, ONE):
+            return r2s
+        elif isinstance(r2s, ONE):
+            return r1s
+        else:
+            return mk_seq(r1s, r2s)
+    else:
+        return r
+
+def flatten_alts(r, alts, seen):
+    if isinstance(r, ALT):
+        flatten_alts(r.r1, alts, seen)
+        flatten_alts(r.r2, alts, seen)
+    else:
+        rs = simp_rexp(r)
+        while isinstance(rs, ALT):
+            add_alt(rs.r1, alts, seen)
+            rs = rs.r2
+        add_alt(rs, alts, seen)
+
+def add_alt(r, alts, seen):
+    if not isinstance(r, ZERO) and r not in seen:
+        seen[r] = True
+        alts.append(r)
+
+# Derivative of an alternative of records that keeps the RECD labels.
+# Records whose derivative is ZERO are dropped, the order of the remaining
+# records is preserved so that POSIX priority is unchanged.
+def record_der(c, r):
+    if isinstance(r, ALT):
+        r1d = record_der(c, r.r1)
+        r2d = record_der(c, r.r2)
+        if isinstance(r1d, ZERO):
+            return r2d
+        elif isinstance(r2d, ZERO):
+            return r1d
+        else:
+            return mk_alt(r1d, r2d)
+    elif isinstance(r, RECD):
+        rd = simp_rexp(der(c, r.r))
+        if isinstance(rd, ZERO):
+            return mk_zero()
+        return mk_recd(r.x, rd)
+    elif isinstance(r, ZERO):
+        return mk_zero()
+    else:
+        raise Exception("Expected an alternative of records")
+
+# Label of the first record that matches the empty string, "" if none does
+def accepting_label(r):
+    if isinstance(r, ALT):
+        x = accepting_label(r.r1)
+        if x != "":
+            return x
+        return accepting_label(r.r2)
+    elif isinstance(r, RECD):
+        if nullable(r.r):
+            return r.x
+    return ""
+
+class DFA(object):
+    def step(self, state, c):
+        raise Exception("DFA.step not implemented")
+
+    def stats_string(self):
+        raise Exception("DFA.stats_string not implemented")
+
+class LazyDFA(DFA):
+    def __init__(self, start):
+        self.states = []   # state number -> interned regex
+        self.labels = []   # state number -> winning record label or ""
+        self.index = {}    # interned regex -> state number
+        self.trans = {}    # (state number, class number) -> state number
+        self.classes = partition_for(start)
+        self.dead = self.add_state(mk_zero())
+        self.start = self.add_state(start)
+
+    def add_state(self, r):
+        n = self.index.get(r, -1)
+        if n < 0:
+            n = len(self.states)
+            self.states.append(r)
+            self.labels.append(accepting_label(r))
+            self.index[r] = n
+        return n
+
+    def step(self, state, c):
+        return self.step_class(state, self.classes.class_of(c))
+
+    def step_class(self, state, k):
+        key = (state, k)
+        n = self.trans.get(key, -1)
+        if n < 0:
+            n = self.add_state(record_der(self.classes.reps[k], self.states[state]))
+            self.trans[key] = n
+        return n
+
+    def stats_string(self):
+        return "DFA: %d states, %d transitions over %d character classes" % (
+            len(self.states), len(self.trans), self.classes.count())
+
+class TableDFA(DFA):
+    """A fully built DFA with a flat transition table of one entry per state and character class."""
+    def __init__(self, labels, classes, table, start, dead):
+        self.labels = labels
+        self.classes = classes
+        self.table = table
+        self.width = classes.count()
+        self.start = start
+        self.dead = dead
+
+    def step(self, state, c):
+        return self.table[state * self.width + self.classes.class_of(c)]
+
+    def stats_string(self):
+        return "DFA: %d states over %d character classes (precompiled table)" % (
+            len(self.labels), self.width)
+
+# Ahead-of-time tables
+
+TABLE_VERSION = "dfa-table-2"
+
+# FNV-1a hash over a structural description of the regex, so that a table
+# built from different regex definitions is recognised as stale
+def rexp_fingerprint(r):
+    h = 2166136261
+    for ch in rexp_key(r):
+        h = ((h ^ ord(ch)) * 16777619) & 0xffffffff
+    return str(h)
+
+def rexp_key(r):
+    if isinstance(r, ZERO):
+        return "0"
+    elif isinstance(r, ONE):
+        return "1"
+    elif isinstance(r, CHAR):
+        return "C" + r.c
+    elif isinstance(r, ALT):
+        return "A(" + rexp_key(r.r1) + "," + rexp_key(r.r2) + ")"
+    elif isinstance(r, SEQ):
+        return "S(" + rexp_key(r.r1) + "," + rexp_key(r.r2) + ")"
+    elif isinstance(r, STAR):
+        return "*(" + rexp_key(r.r) + ")"
+    elif isinstance(r, RANGE):
+        return "R[" + "".join(r.cs) + "]"
+    elif isinstance(r, PLUS):
+        return "+(" + rexp_key(r.r) + ")"
+    elif isinstance(r, OPTIONAL):
+        return "?(" + rexp_key(r.r) + ")"
+    elif isinstance(r, NTIMES):
+        return "N" + str(r.n) + "(" + rexp_key(r.r) + ")"
+    elif isinstance(r, RECD):
+        return "X" + r.x + "(" + rexp_key(r.r) + ")"
+    else:
+        raise Exception("Unknown regular expression type")
+
+def explore(dfa):
+    # Visit every state reachable from the start state over all classes
+    todo = [dfa.start]
+    seen = {dfa.start: True}
+    while todo:
+        state = todo.pop()
+        for k in range(dfa.classes.count()):
+            n = dfa.step_class(state, k)
+            if n not in seen:
+                seen[n] = True
+                todo.append(n)
+
+def minimise(dfa):
+    """
+    Moore partition refinement of a fully explored LazyDFA. Returns
+    (labels, table, start, dead) with states numbered in breadth-first
+    order from the start state and the dead state numbered 0.
+    """
+    count = len(dfa.states)
+    rows = []
+    for state in range(count):
+        row = []
+        for k in range(dfa.classes.count()):
+            row.append(dfa.trans[(state, k)])
+        rows.append(row)
+    block = {}
+    for state in range(count):
+        block[state] = dfa.labels[state]
+    nblocks = len(set(block.values()))
+    while True:
+        sigs = {}
+        new_block = {}
+        for state in range(count):
+            sig = (block[state],) + tuple([block[t] for t in rows[state]])
+            new_block[state] = sigs.setdefault(sig, len(sigs))
+        block = new_block
+        if len(sigs) == nblocks:
+            break
+        nblocks = len(sigs)
+    # renumber: dead block first, then breadth-first from the start state
+    number = {block[dfa.dead]: 0}
+    queue = [dfa.start]
+    k = 0
+    while k < len(queue):
+        state = queue[k]
+        k += 1
+        if block[state] not in number:
+            number[block[state]] = len(number)
+        for t in rows[state]:
+            if block[t] not in number and t not in queue:
+                queue.append(t)
+    representative = {}
+    for state in queue + [dfa.dead]:
+        representative.setdefault(number[block[state]], state)
+    labels = []
+    table = []
+    for n in range(len(number)):
+        state = representative[n]
+        labels.append(dfa.labels[state])
+        for t in rows[state]:
+            table.append(number[block[t]])
+    return labels, table, number[block[dfa.start]], 0
+
+def dump_table(path, fingerprint, labels, classes, table, start, dead):
+    width = classes.count()
+    lines = [TABLE_VERSION + " " + fingerprint,
+             "%d %d %d %d" % (len(labels), start, dead, width),
+             " ".join([str(k) for k in classes.table])]
+    for state in range(len(labels)):
+        parts = [labels[state] or "-"]
+        for k in range(width):
+            t = table[state * width + k]
+            if t != dead:
+                parts.append("%d:%d" % (k, t))
+        lines.append(" ".join(parts))
+    f = open(path, "w")
+    f.write("\n".join(lines) + "\n")
+    f.close()
+
+def read_file_once(path):
+    try:
+        fd = os.open(path, os.O_RDONLY, 0)
+    except OSError:
+        return ""
+    try:
+        data = os.read(fd, int(os.fstat(fd).st_size))
+    finally:
+        os.close(fd)
+    return data
+
+def load_table(path, fingerprint):
+    """
+    Load a table written by dump_table. Returns None when the file is
+    missing, malformed or stale (built from different regex definitions).
+    """
+    data = read_file_once(path)
+    if data == "":
+        return None
+    lines = data.split("\n")
+    header = lines[0].split(" ")
+    if len(header) != 2 or header[0] != TABLE_VERSION:
+        return None
+    if header[1] != fingerprint:
+        print("Lexer table " + path + " is stale, rebuild it by running dfa_lexer.py")
+        return None
+    sizes = lines[1].split(" ")
+    if len(sizes) != 4:
+        return None
+    count = int(sizes[0])
+    start = int(sizes[1])
+    dead = int(sizes[2])
+    width = int(sizes[3])
+    if len(lines) < count + 3:
+        return None
+    # character class of every character, and a representative per class
+    class_table = [int(k) for k in lines[2].split(" ")]
+    if len(class_table) != 256:
+        return None
+    reps = [chr(0)] * width
+    i = 255
+    while i >= 0:
+        reps[class_table[i]] = chr(i)
+        i -= 1
+    labels = []
+    table = [dead] * (count * width)
+    for state in range(count):
+        parts = lines[state + 3].split(" ")
+        label = parts[0]
+        if label == "-":
+            label = ""
+        labels.append(label)
+        for k in range(1, len(parts)):
+            entry = parts[k].split(":")
+            table[state * width + int(entry[0])] = int(entry[1])
+    return TableDFA(labels, CharClasses(class_table, reps), table, start, dead)
+
+# Longest-match tokenisation; returns the same (label, text) pairs as lexing_simp
+def lexing_dfa(dfa, s):
+    pairs = []
+    pos = 0
+    n = len(s)
+    while pos < n:
+        state = dfa.start
+        i = pos
+        last_end = -1
+        last_label = ""
+        while i < n:
+            state = dfa.step(state, s[i])
+            if state == dfa.dead:
+                break
+            i += 1
+            label = dfa.labels[state]
+            if label != "":
+                last_end = i
+                last_label = label
+        if last_end < 0:
+            # i is where the DFA reached the dead state or the end of input
+            resume = lex_error(s, pos, i, 0)
+            pairs.append((ERROR_LABEL, s[pos:resume]))
+            pos = resume
+            continue
+        pairs.append((last_label, s[pos:last_end]))
+        pos = last_end
+    return pairs
+
+assert isinstance(LANGUAGE_REGEX, STAR)
+TOKEN_REGEX = LANGUAGE_REGEX.r
+FINGERPRINT = rexp_fingerprint(TOKEN_REGEX)
+TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "while_lexer.table")
+
+class DFAHolder(object):
+    def __init__(self, dfa):
+        self.dfa = dfa
+        self.loaded = False
+
+HOLDER = DFAHolder(LazyDFA(TOKEN_REGEX))
+
+def current_dfa():
+    # The precompiled table is loaded on first use, the lazy DFA is the fallback
+    if not HOLDER.loaded:
+        HOLDER.loaded = True
+        table = load_table(TABLE_PATH, FINGERPRINT)
+        if table is not None:
+            HOLDER.dfa = table
+    return HOLDER.dfa
+
+def build_table(path):
+    dfa = LazyDFA(TOKEN_REGEX)
+    explore(dfa)
+    labels, table, start, dead = minimise(dfa)
+    dump_table(path, FINGERPRINT, labels, dfa.classes, table, start, dead)
+    print("Wrote %s: %d states (%d before minimisation)" % (path, len(labels), len(dfa.states)))
+
+def tokenise(s):
+    return pack_tokens(lexing_dfa(current_dfa(), s))
+
+def lex(contents):
+    print("Lex (DFA):")
+    LEX_ERRORS.reset()
+    start = time.time()
+    tokens = tokenise(contents)
+    end = time.time()
+    print(tokens)
+    print("Lexing Time taken: " + str(end - start) + " seconds")
+    print(current_dfa().stats_string())
+    if LEX_ERRORS.count() > 0:
+        print(LEX_ERRORS.report_string())
+    return tokens
+
+if __name__ == "__main__":
+    build_table(TABLE_PATH)
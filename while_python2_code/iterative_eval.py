@@ -1,11 +1,34 @@
 from parser import If, While, Assign, Read, WriteId, WriteString, Var, Num, Aop, TrueConst, FalseConst, Bop, Lop, Skip
 import sys
 
-def env_update(env, varname, value):
+class Env(object):
+    """
+    Variable bindings indexed by the symbol ids of the program; bound[sym]
+    tells whether the variable has been assigned.
+    """
+    __slots__ = ('values', 'bound')
+
+    def __init__(self, values, bound):
+        self.values = values
+        self.bound = bound
+
+def empty_env(symbols):
+    n = symbols.count()
+    return Env([0] * n, [False] * n)
+
+def env_lookup(env, sym, name):
+    """Value of the variable with symbol id sym; name is for the error."""
+    if not env.bound[sym]:
+        raise Exception("Undefined variable: " + name)
+    return env.values[sym]
+
+def env_update(env, sym, value):
     """Update the environment with a new variable binding."""
-    new_env = env.copy()
-    new_env[varname] = value
-    return new_env
+    values = env.values[:]
+    bound = env.bound[:]
+    values[sym] = value
+    bound[sym] = True
+    return Env(values, bound)
 
 # Iterative Evaluation of Arithmetic Expressions
 def eval_aexp_iterative(aexp, env):
@@ -18,7 +41,7 @@ def eval_aexp_iterative(aexp, env):
     while stack:
         node, visited = stack.pop()
         if isinstance(node, Var):
-            result_stack.append(env[node.s])
+            result_stack.append(env_lookup(env, node.sym, node.s))
         elif isinstance(node, Num):
             result_stack.append(node.i)
         elif isinstance(node, Aop):
@@ -122,7 +145,7 @@ def run_program_iterative(block, env):
 
         elif isinstance(stmt, Assign):
             value = eval_aexp_iterative(stmt.aexp, env)
-            env = env_update(env, stmt.varname, value)
+            env = env_update(env, stmt.sym, value)
 
         elif isinstance(stmt, Read):
             line = sys.stdin.readline().strip()
@@ -130,10 +153,10 @@ def run_program_iterative(block, env):
                 value = int(line)
             except:
                 raise Exception("Input is not a valid integer: " + line)
-            env = env_update(env, stmt.varname, value)
+            env = env_update(env, stmt.sym, value)
 
         elif isinstance(stmt, WriteId):
-            sys.stdout.write(str(env[stmt.varname]))
+            sys.stdout.write(str(env_lookup(env, stmt.sym, stmt.varname)))
 
         elif isinstance(stmt, WriteString):
             stext = stmt.text.replace("\"", "").replace("\\n", "\n")
@@ -162,11 +185,20 @@ def run_program_iterative(block, env):
 # Iterative Evaluation of a Program
 import time
 
-def run(ast):
+def env_to_string(env, symbols):
+    # In the format of the dict the environment used to be, with the
+    # variables in the order they first appear in the program
+    items = []
+    for sym in range(len(env.values)):
+        if env.bound[sym]:
+            items.append(repr(symbols.name(sym)) + ": " + repr(env.values[sym]))
+    return "{" + ", ".join(items) + "}"
+
+def run(ast, symbols):
     print("Eval:")
     start = time.time()
-    final_env = run_program_iterative(ast, {})
+    final_env = run_program_iterative(ast, empty_env(symbols))
     end = time.time()
-    print(str(final_env) + "\n")
+    print(env_to_string(final_env, symbols) + "\n")
     print("Evaluation Time: " + str(end - start) + "s")
     return 0
\ No newline at end of file
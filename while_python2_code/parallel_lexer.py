@@ -0,0 +1,155 @@
+"""
+Parallel lexing of large WHILE sources.
+
+The source is cut at newlines that are outside strings and comments into
+about as many chunks as there are workers, the chunks are tokenised by a
+pool of processes and their token buffers are stitched back together with
+the offsets moved to the start of each chunk. The tokens are the ones
+tokenise gives for the whole source.
+
+A newline outside strings and comments can only be whitespace, which the
+token records never join to a neighbouring token, so no token crosses such
+a cut. The pre-scan follows the token regexes: a string runs from a speech
+mark to the next one and may contain newlines, and a comment runs from //
+to the end of its line, including the newline, when the whole line matches
+the comment regex. Otherwise the lexer reads the // as two operators and
+the rest of the line as ordinary tokens, which may open a string.
+
+This module is Python2 only: RPython has no process pool.
+"""
+import time
+from multiprocessing import Pool
+
+from lexer import (tokenise, TokenBuffer, SymbolTable, LexError, DERIV_CACHE,
+                   SIZE_TRACE, LEX_ERRORS, COMMENT_REGEX, intern_rexp,
+                   partition_for, matches_lexeme)
+
+COMMENT = intern_rexp(COMMENT_REGEX)
+
+
+def split_points(s):
+    """
+    The offsets just after every newline of s that is outside strings and
+    comments, in increasing order.
+    """
+    points = []
+    i = 0
+    n = len(s)
+    while i < n:
+        c = s[i]
+        if c == "\n":
+            points.append(i + 1)
+            i += 1
+        elif c == "\"":
+            end = s.find("\"", i + 1)
+            if end < 0:
+                break
+            i = end + 1
+        elif c == "/" and s.startswith("//", i):
+            end = s.find("\n", i + 2)
+            if end < 0:
+                break
+            if is_comment(s, i, end + 1):
+                points.append(end + 1)
+                i = end + 1
+            else:
+                # Not a comment: scan the rest of the line as ordinary text
+                i = next_special(s, i + 2)
+        else:
+            # Skip to the next character that can change the state
+            i = next_special(s, i + 1)
+    return points
+
+
+def is_comment(s, start, end):
+    # Whether s[start:end], from // to a newline, is lexed as one comment
+    return matches_lexeme(COMMENT, partition_for(COMMENT), s, start, end)
+
+
+def next_special(s, i):
+    n = len(s)
+    end = n
+    for c in "\n\"/":
+        j = s.find(c, i, end)
+        if j >= 0:
+            end = j
+    return end
+
+
+def split_source(s, parts):
+    """
+    The bounds of at most parts chunks of s of about equal length, cut at
+    the first split point after each even share.
+    """
+    points = split_points(s)
+    bounds = [0]
+    j = 0
+    for k in range(1, parts):
+        target = len(s) * k // parts
+        while j < len(points) and (points[j] < target or points[j] <= bounds[-1]):
+            j += 1
+        if j == len(points):
+            break
+        if points[j] < len(s):
+            bounds.append(points[j])
+    bounds.append(len(s))
+    return bounds
+
+
+def lex_chunk(job):
+    # Runs in a worker; the buffer is pickled back with its own tables,
+    # together with the errors of the recovery mode, at offsets in the
+    # whole source
+    chunk, base = job
+    LEX_ERRORS.reset()
+    try:
+        tokens = tokenise(chunk)
+    except LexError as e:
+        raise LexError(base + e.offset)
+    offsets = [base + offset for offset in LEX_ERRORS.offsets]
+    return tokens, offsets, LEX_ERRORS.texts
+
+
+def tokenise_parallel(s, workers, pool=None):
+    """
+    Tokenises s with the given number of worker processes. A pool may be
+    passed in to be reused across calls; otherwise one is started and
+    closed here. Gives the same TokenBuffer as tokenise(s).
+    """
+    bounds = split_source(s, workers)
+    chunks = [s[bounds[k]:bounds[k + 1]] for k in range(len(bounds) - 1)]
+    if len(chunks) <= 1 or workers <= 1:
+        return tokenise(s)
+    jobs = [(chunks[k], bounds[k]) for k in range(len(chunks))]
+    own = pool is None
+    if own:
+        pool = Pool(workers)
+    try:
+        results = pool.map(lex_chunk, jobs, 1)
+    finally:
+        if own:
+            pool.close()
+            pool.join()
+    tokens = TokenBuffer(SymbolTable())
+    for k in range(len(results)):
+        chunk_tokens, offsets, texts = results[k]
+        tokens.extend(chunk_tokens, bounds[k])
+        for j in range(len(offsets)):
+            LEX_ERRORS.record(offsets[j], texts[j])
+    return tokens
+
+
+def lex_parallel(contents, workers):
+    print("Lexed:")
+    DERIV_CACHE.reset_stats()
+    SIZE_TRACE.reset()
+    LEX_ERRORS.reset()
+    start = time.time()
+    tokens = tokenise_parallel(contents, workers)
+    end = time.time()
+    print(tokens)
+    print("Lexing Time taken: " + str(end - start) + " seconds (" +
+          str(workers) + " workers)")
+    if LEX_ERRORS.count() > 0:
+        print(LEX_ERRORS.report_string())
+    return tokens
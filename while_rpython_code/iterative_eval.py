@@ -41,11 +41,34 @@ def remove_quotes_and_convert_newlines(s):
 
     return "".join(result_chars)
 
-def env_update(env, varname, value):
+class Env(object):
+    """
+    Variable bindings indexed by the symbol ids of the program; bound[sym]
+    tells whether the variable has been assigned.
+    """
+    __slots__ = ('values', 'bound')
+
+    def __init__(self, values, bound):
+        self.values = values
+        self.bound = bound
+
+def empty_env(symbols):
+    n = symbols.count()
+    return Env([0] * n, [False] * n)
+
+def env_lookup(env, sym, name):
+    """Value of the variable with symbol id sym; name is for the error."""
+    if not env.bound[sym]:
+        raise Exception("Undefined variable: " + name)
+    return env.values[sym]
+
+def env_update(env, sym, value):
     """Update the environment with a new variable binding."""
-    new_env = env.copy()
-    new_env[varname] = value
-    return new_env
+    values = env.values[:]
+    bound = env.bound[:]
+    values[sym] = value
+    bound[sym] = True
+    return Env(values, bound)
 
 # Iterative Evaluation of Arithmetic Expressions
 def eval_aexp_iterative(aexp, env):
@@ -58,7 +81,7 @@ def eval_aexp_iterative(aexp, env):
     while stack:
         node, visited = stack.pop()
         if isinstance(node, Var):
-            result_stack.append(env[node.s])
+            result_stack.append(env_lookup(env, node.sym, node.s))
         elif isinstance(node, Num):
             result_stack.append(node.i)
         elif isinstance(node, Aop):
@@ -163,7 +186,7 @@ def run_program_iterative(block, env):
 
         elif isinstance(stmt, Assign):
             value = eval_aexp_iterative(stmt.aexp, env)
-            env = env_update(env, stmt.varname, value)
+            env = env_update(env, stmt.sym, value)
 
         elif isinstance(stmt, Read):
             line = rpython_read_line()
@@ -171,10 +194,10 @@ def run_program_iterative(block, env):
                 value = int(line)
             except:
                 raise Exception("Input is not a valid integer: " + line)
-            env = env_update(env, stmt.varname, value)
+            env = env_update(env, stmt.sym, value)
 
         elif isinstance(stmt, WriteId):
-            rpython_print(str(env[stmt.varname]))
+            rpython_print(str(env_lookup(env, stmt.sym, stmt.varname)))
 
         elif isinstance(stmt, WriteString):
             stext = remove_quotes_and_convert_newlines(stmt.text)
@@ -203,17 +226,18 @@ def run_program_iterative(block, env):
 # Iterative Evaluation of a Program
 import time
 
-def env_to_string(env):
+def env_to_string(env, symbols):
     items = []
-    for k, v in env.items():
-        items.append(str(k) + ": " + str(v))
+    for sym in range(len(env.values)):
+        if env.bound[sym]:
+            items.append(symbols.name(sym) + ": " + str(env.values[sym]))
     return "{" + ", ".join(items) + "}"
 
-def run(ast):
+def run(ast, symbols):
     print("Eval:")
     start = time.time()
-    final_env = run_program_iterative(ast, {})
+    final_env = run_program_iterative(ast, empty_env(symbols))
     end = time.time()
-    print(env_to_string(final_env) + "\n")
+    print(env_to_string(final_env, symbols) + "\n")
     print("Evaluation Time: " + str(end - start) + "s")
     return 0
\ No newline at end of file
@@ -1,4 +1,4 @@
-from lexer import T_ID, T_OP, T_NUM, T_SEMI, T_KEYWORD, T_STRING, T_PAREN
+from lexer import K_NONE, K_SEMI, K_NUM, K_KEYWORD, K_OP, K_STRING, K_PAREN, K_ID
 
 # AST classes
 
@@ -46,29 +46,32 @@ class While(Stmt):
     
 
 class Assign(Stmt):
-    __slots__ = ('varname', 'aexp')
+    __slots__ = ('varname', 'aexp', 'sym')
 
-    def __init__(self, varname, aexp):
+    def __init__(self, varname, aexp, sym):
         self.varname = varname
         self.aexp = aexp
+        self.sym = sym  # symbol id of varname
 
     def __repr__(self):
         return "Assign(%s, %s)" % (self.varname, self.aexp.__repr__())
 
 class Read(Stmt):
-    __slots__ = ('varname',)
+    __slots__ = ('varname', 'sym')
 
-    def __init__(self, varname):
+    def __init__(self, varname, sym):
         self.varname = varname
+        self.sym = sym
 
     def __repr__(self):
         return "Read(%s)" % self.varname
 
 class WriteId(Stmt):
-    __slots__ = ('varname',)
+    __slots__ = ('varname', 'sym')
 
-    def __init__(self, varname):
+    def __init__(self, varname, sym):
         self.varname = varname
+        self.sym = sym
 
     def __repr__(self):
         return "WriteId(%s)" % self.varname
@@ -86,10 +89,11 @@ class AExp(object):
     __slots__ = ()
 
 class Var(AExp):
-    __slots__ = ('s',)
+    __slots__ = ('s', 'sym')
 
-    def __init__(self, s):
+    def __init__(self, s, sym):
         self.s = s
+        self.sym = sym
 
     def __repr__(self):
         return "Var(%s)" % self.s
@@ -156,19 +160,12 @@ class Lop(BExp):
 class ParseError(Exception):
     __slots__ = ()
 
-def peek_token(tokens, i):
-    """Return tokens[i] if in range, otherwise None."""
-    if i < len(tokens):
-        return tokens[i]
-    return None
-
 def match_keyword(tokens, i, kw):
     """
     If tokens[i] is a T_KEYWORD(kw), return (True, i+1).
     Otherwise return (False, i).
     """
-    t = peek_token(tokens, i)
-    if t is not None and isinstance(t, T_KEYWORD) and t.s == kw:
+    if tokens.kind(i) == K_KEYWORD and tokens.text(i) == kw:
         return True, i + 1
     return False, i
 
@@ -177,8 +174,7 @@ def match_op(tokens, i, op):
     If tokens[i] is T_OP(op), return (True, i+1).
     Otherwise return (False, i).
     """
-    t = peek_token(tokens, i)
-    if t is not None and isinstance(t, T_OP) and t.s == op:
+    if tokens.kind(i) == K_OP and tokens.text(i) == op:
         return True, i + 1
     return False, i
 
@@ -187,8 +183,7 @@ def match_paren(tokens, i, par):
     If tokens[i] is T_PAREN(par), return (True, i+1).
     Otherwise return (False, i).
     """
-    t = peek_token(tokens, i)
-    if t is not None and isinstance(t, T_PAREN) and t.s == par:
+    if tokens.kind(i) == K_PAREN and tokens.text(i) == par:
         return True, i + 1
     return False, i
 
@@ -197,19 +192,17 @@ def match_semi(tokens, i):
     If tokens[i] is T_SEMI, return (True, i+1).
     Otherwise return (False, i).
     """
-    t = peek_token(tokens, i)
-    if isinstance(t, T_SEMI):
+    if tokens.kind(i) == K_SEMI:
         return True, i + 1
     return False, i
 
 def match_id(tokens, i):
     """
-    If tokens[i] is T_ID(...), return (string_of_id, i+1).
+    If tokens[i] is T_ID(...), return (string_of_id, symbol_id, i+1).
     Otherwise raise ParseError.
     """
-    t = peek_token(tokens, i)
-    if t is not None and isinstance(t, T_ID):
-        return t.s, i + 1
+    if tokens.kind(i) == K_ID:
+        return tokens.text(i), tokens.symbol(i), i + 1
     raise ParseError("Expected identifier at position %d" % i)
 
 def match_num(tokens, i):
@@ -217,9 +210,8 @@ def match_num(tokens, i):
     If tokens[i] is T_NUM(...), return (int_value, i+1).
     Otherwise raise ParseError.
     """
-    t = peek_token(tokens, i)
-    if t is not None and isinstance(t, T_NUM):
-        return t.n, i + 1
+    if tokens.kind(i) == K_NUM:
+        return tokens.number(i), i + 1
     raise ParseError("Expected number at position %d" % i)
 
 def match_string(tokens, i):
@@ -227,9 +219,8 @@ def match_string(tokens, i):
     If tokens[i] is T_STRING(...), return (string_value, i+1).
     Otherwise raise ParseError.
     """
-    t = peek_token(tokens, i)
-    if t is not None and isinstance(t, T_STRING):
-        return t.s, i + 1
+    if tokens.kind(i) == K_STRING:
+        return tokens.text(i), i + 1
     raise ParseError("Expected string literal at position %d" % i)
 
 
@@ -241,12 +232,9 @@ def parse_aexp(tokens, i):
     AExp -> Te ( ('+'|'-') AExp ) || Te
     """
     left, i = parse_te(tokens, i)
-    while True:
-        t = peek_token(tokens, i)
-        if t is None:
-            break
-        if isinstance(t, T_OP) and (t.s == "+" or t.s == "-"):
-            op = t.s
+    while tokens.kind(i) == K_OP:
+        op = tokens.text(i)
+        if op == "+" or op == "-":
             i += 1
             # parse the "right" as aexp again
             right, i = parse_te(tokens, i)
@@ -260,12 +248,9 @@ def parse_te(tokens, i):
     Te -> Fa ( ('*'|'/'|'%') Te ) || Fa
     """
     left, i = parse_fa(tokens, i)
-    while True:
-        t = peek_token(tokens, i)
-        if t is None:
-            break
-        if isinstance(t, T_OP) and (t.s == "*" or t.s == "/" or t.s == "%"):
-            op = t.s
+    while tokens.kind(i) == K_OP:
+        op = tokens.text(i)
+        if op == "*" or op == "/" or op == "%":
             i += 1
             right, i = parse_fa(tokens, i)
             left = Aop(op, left, right)
@@ -285,13 +270,13 @@ def parse_fa(tokens, i):
         return node, i2
 
     # else if T_ID
-    t = peek_token(tokens, i)
-    if isinstance(t, T_ID):
-        varname, i2 = match_id(tokens, i)
-        return Var(varname), i2
+    k = tokens.kind(i)
+    if k == K_ID:
+        varname, sym, i2 = match_id(tokens, i)
+        return Var(varname, sym), i2
 
     # else if T_NUM
-    if isinstance(t, T_NUM):
+    if k == K_NUM:
         numval, i2 = match_num(tokens, i)
         return Num(numval), i2
 
@@ -323,9 +308,8 @@ def parse_bexp(tokens, i):
         # if AExp fails, we can try other alternatives below.
         i2 = i
         left = None
-    t = peek_token(tokens, i2)
-    if left is not None and t is not None and isinstance(t, T_OP) and t.s in ["==", "!=", "<", ">", "<=", ">="]:
-        op = t.s
+    if left is not None and tokens.kind(i2) == K_OP and tokens.text(i2) in ["==", "!=", "<", ">", "<=", ">="]:
+        op = tokens.text(i2)
         i2 += 1
         right, i2 = parse_aexp(tokens, i2)
         return Bop(op, left, right), i2
@@ -339,9 +323,8 @@ def parse_bexp(tokens, i):
         if not matched2:
             raise ParseError("Missing ')' in BExp at position %d" % i2)
         # check for && or || immediately following the parenthesized BExp.
-        t = peek_token(tokens, i2)
-        if t is not None and isinstance(t, T_OP) and t.s in ["&&", "||"]:
-            op = t.s
+        if tokens.kind(i2) == K_OP and tokens.text(i2) in ["&&", "||"]:
+            op = tokens.text(i2)
             i2 += 1
             right, i2 = parse_bexp(tokens, i2)
             return Lop(op, inner, right), i2
@@ -349,11 +332,11 @@ def parse_bexp(tokens, i):
         return inner, i2
 
     # try boolean constants
-    t = peek_token(tokens, orig_i)
-    if t is not None and isinstance(t, T_KEYWORD):
-        if t.s == "true":
+    if tokens.kind(orig_i) == K_KEYWORD:
+        kw = tokens.text(orig_i)
+        if kw == "true":
             return TrueConst(), orig_i+1
-        elif t.s == "false":
+        elif kw == "false":
             return FalseConst(), orig_i+1
 
     # try a plain parenthesized boolean expression.
@@ -389,14 +372,13 @@ def parse_stmt(tokens, i):
         return Skip(), i2
 
     # if T_ID => parse assign
-    t = peek_token(tokens, i)
-    if isinstance(t, T_ID):
-        varname, i2 = match_id(tokens, i)
+    if tokens.kind(i) == K_ID:
+        varname, sym, i2 = match_id(tokens, i)
         # next token must be T_OP(":=")
         matchedOp, i3 = match_op(tokens, i2, ":=")
         if matchedOp:
             a, i4 = parse_aexp(tokens, i3)
-            return Assign(varname, a), i4
+            return Assign(varname, a, sym), i4
         # if it's not ':=', we proceed to an error
         raise ParseError("Expected ':=' after ID at position %d" % i2)
 
@@ -427,33 +409,33 @@ def parse_stmt(tokens, i):
     # read ID
     matched, i2 = match_keyword(tokens, i, "read")
     if matched:
-        varname, i2 = match_id(tokens, i2)
-        return Read(varname), i2
+        varname, sym, i2 = match_id(tokens, i2)
+        return Read(varname, sym), i2
 
     # write ...
     matched, i2 = match_keyword(tokens, i, "write")
     if matched:
         # check if next is T_ID or T_STRING or '(' T_ID ')' or '(' T_STRING ')'
-        t2 = peek_token(tokens, i2)
-        if isinstance(t2, T_ID):
-            varname, i3 = match_id(tokens, i2)
-            return WriteId(varname), i3
-        elif isinstance(t2, T_STRING):
+        k2 = tokens.kind(i2)
+        if k2 == K_ID:
+            varname, sym, i3 = match_id(tokens, i2)
+            return WriteId(varname, sym), i3
+        elif k2 == K_STRING:
             txt, i3 = match_string(tokens, i2)
             return WriteString(txt), i3
-        elif isinstance(t2, T_PAREN) and t2.s == "(":
+        elif k2 == K_PAREN and tokens.text(i2) == "(":
             # skip '('
             _, i3 = match_paren(tokens, i2, "(")
             # next could be ID or STRING
-            t3 = peek_token(tokens, i3)
-            if isinstance(t3, T_ID):
-                varname, i4 = match_id(tokens, i3)
+            k3 = tokens.kind(i3)
+            if k3 == K_ID:
+                varname, sym, i4 = match_id(tokens, i3)
                 # expect ')'
                 matched3, i5 = match_paren(tokens, i4, ")")
                 if not matched3:
                     raise ParseError("Missing ')' after write( ID ) at %d" % i4)
-                return WriteId(varname), i5
-            elif isinstance(t3, T_STRING):
+                return WriteId(varname, sym), i5
+            elif k3 == K_STRING:
                 txt, i4 = match_string(tokens, i3)
                 matched3, i5 = match_paren(tokens, i4, ")")
                 if not matched3:
@@ -472,17 +454,16 @@ def parse_stmts(tokens, i):
     Stmts -> Stmt ';' Stmts
            | Stmt
     """
-    stmt, i2 = parse_stmt(tokens, i)
-    # check if next token is ';'
-    matched, i3 = match_semi(tokens, i2)
-    if matched:
-        # parse more statements
-        rest, i4 = parse_stmts(tokens, i3)
-        # combine them into a list
-        return [stmt] + rest, i4
-    else:
-        # just one statement
-        return [stmt], i2
+    stmts = []
+    while True:
+        stmt, i = parse_stmt(tokens, i)
+        stmts.append(stmt)
+        # the parser never goes back into a finished statement
+        tokens.release(i)
+        # check if next token is ';', then parse more statements
+        matched, i = match_semi(tokens, i)
+        if not matched:
+            return stmts, i
 
 def parse_block(tokens, i):
     """
@@ -522,13 +503,13 @@ def print_ast(ast_list):
 
 def parse_program(tokens):
     """
-    Parse the entire token list as a "block" (or list of statements).
-    Return the AST (list of statements). 
+    Parse all tokens of the token source as a "block" (or list of statements).
+    Return the AST (list of statements).
     """
     start = time.time()
     block, i = parse_stmts(tokens, 0)
     end = time.time()
-    if i != len(tokens):
+    if tokens.kind(i) != K_NONE:
         raise ParseError("Extra tokens after valid parse at position %d" % i)
     print("Parsed: ")
     print(print_ast(block))
@@ -41,17 +41,40 @@ def remove_quotes_and_convert_newlines(s):
 
     return "".join(result_chars)
 
-def env_update(env, varname, value):
+class Env(object):
+    """
+    Variable bindings indexed by the symbol ids of the program; bound[sym]
+    tells whether the variable has been assigned.
+    """
+    __slots__ = ('values', 'bound')
+
+    def __init__(self, values, bound):
+        self.values = values
+        self.bound = bound
+
+def empty_env(symbols):
+    n = symbols.count()
+    return Env([0] * n, [False] * n)
+
+def env_lookup(env, sym, name):
+    """Value of the variable with symbol id sym; name is for the error."""
+    if not env.bound[sym]:
+        raise Exception("Undefined variable: " + name)
+    return env.values[sym]
+
+def env_update(env, sym, value):
     """Update the environment with a new variable binding."""
-    new_env = env.copy()
-    new_env[varname] = value
-    return new_env
+    values = env.values[:]
+    bound = env.bound[:]
+    values[sym] = value
+    bound[sym] = True
+    return Env(values, bound)
 
 # Arithmetic Expressions
 def eval_aexp(aexp, env):
     """Evaluate an arithmetic expression under the given environment."""
     if isinstance(aexp, Var):
-        return env[aexp.s]
+        return env_lookup(env, aexp.sym, aexp.s)
     elif isinstance(aexp, Num):
         return aexp.i
     elif isinstance(aexp, Aop):
@@ -119,7 +142,7 @@ def eval_stmt(stmt, env):
 
     elif isinstance(stmt, Assign):
         # Use stmt.varname and stmt.aexp
-        return env_update(env, stmt.varname, eval_aexp(stmt.aexp, env))
+        return env_update(env, stmt.sym, eval_aexp(stmt.aexp, env))
 
     elif isinstance(stmt, Read):
         line = rpython_read_line()
@@ -127,10 +150,10 @@ def eval_stmt(stmt, env):
             value = int(line)
         except:
             raise Exception("Input is not a valid integer: " + line)
-        return env_update(env, stmt.varname, value)
+        return env_update(env, stmt.sym, value)
 
     elif isinstance(stmt, WriteId):
-        rpython_print(str(env[stmt.varname]))
+        rpython_print(str(env_lookup(env, stmt.sym, stmt.varname)))
         return env
 
     elif isinstance(stmt, WriteString):
@@ -162,24 +185,25 @@ def eval_block(block, env):
     return env
 
 # Top-Level Program Evaluation
-def eval_program(block):
+def eval_program(block, symbols):
     """Evaluate the entire program from an empty environment."""
-    return eval_block(block, {})
+    return eval_block(block, empty_env(symbols))
 
 # Recursive Evaluation
 import time
 
-def env_to_string(env):
+def env_to_string(env, symbols):
     items = []
-    for k, v in env.items():
-        items.append(str(k) + ": " + str(v))
+    for sym in range(len(env.values)):
+        if env.bound[sym]:
+            items.append(symbols.name(sym) + ": " + str(env.values[sym]))
     return "{" + ", ".join(items) + "}"
 
-def run(ast):
+def run(ast, symbols):
     print("Eval:")
     start = time.time()
-    final_env = eval_program(ast)
+    final_env = eval_program(ast, symbols)
     end = time.time()
-    print(env_to_string(final_env) + "\n")
+    print(env_to_string(final_env, symbols) + "\n")
     print("Recursive evaluation Time: " + str(end - start))
     return 0
\ No newline at end of file